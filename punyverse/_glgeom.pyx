@@ -1,8 +1,12 @@
+cimport cpython.array  # Lets array.array be used as a typed memoryview on Python 2
+cimport cython
+from libc.math cimport sin, cos
 from libc.string cimport memcpy
 
 include "_cyopengl.pxi"
 cdef float PI = 3.1415926535897932324626
 cdef float TWOPI = PI * 2
+cdef double DEG_TO_RAD = 3.1415926535897932324626 / 180
 
 cdef extern from "Python.h":
     object PyBytes_FromStringAndSize(const char *s, Py_ssize_t len)
@@ -17,13 +21,15 @@ cpdef bytes bgr_to_rgb(bytes buffer, int width, int height, bint alpha=0):
     cdef char *result = PyBytes_AsString(final)
     cdef const char *source = PyBytes_AsString(buffer)
     cdef int x, y, offset, i, row = width * depth
-    for y in xrange(height):
-        for x in xrange(width):
-            offset = y * row + x * depth
-            for i in xrange(depth2):
-                result[offset+i] = source[offset+depth2-i-1]
-            if alpha:
-                result[offset+depth2] = source[offset+depth2]
+    # Images are decoded on worker threads, so let them run in parallel.
+    with nogil:
+        for y in range(height):
+            for x in range(width):
+                offset = y * row + x * depth
+                for i in range(depth2):
+                    result[offset+i] = source[offset+depth2-i-1]
+                if alpha:
+                    result[offset+depth2] = source[offset+depth2]
     return final
 
 
@@ -33,7 +39,68 @@ cpdef bytes flip_vertical(bytes buffer, int width, int height):
     cdef char *result = PyBytes_AsString(final)
     cdef const char *source = PyBytes_AsString(buffer)
     cdef int y1, y2, row = length / height
-    for y1 in xrange(height):
-        y2 = height - y1 - 1
-        memcpy(result + y1 * row, source + y2 * row, row)
+    with nogil:
+        for y1 in range(height):
+            y2 = height - y1 - 1
+            memcpy(result + y1 * row, source + y2 * row, row)
     return final
+
+
+# Matrices are column major float[16], as in Matrix4f.
+cdef inline void mat4_multiply(float *out, const float *a, const float *b) noexcept nogil:
+    cdef float result[16]
+    cdef int i, j
+    for i in range(4):
+        for j in range(4):
+            result[i * 4 + j] = (<double> a[j] * b[i * 4] + <double> a[4 + j] * b[i * 4 + 1] +
+                                 <double> a[8 + j] * b[i * 4 + 2] + <double> a[12 + j] * b[i * 4 + 3])
+    # Computed on the side, so that out may be a or b.
+    memcpy(out, result, sizeof(result))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef mat4_multiply_into(float[::1] out, float[::1] a, float[::1] b):
+    assert out.shape[0] == a.shape[0] == b.shape[0] == 16
+    mat4_multiply(&out[0], &a[0], &b[0])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef mat4_multiply_batch(float[::1] out, float[::1] a, float[::1] matrices):
+    cdef int i, count = matrices.shape[0] // 16
+    assert a.shape[0] == 16 and out.shape[0] >= count * 16
+    with nogil:
+        for i in range(count):
+            mat4_multiply(&out[i * 16], &a[0], &matrices[i * 16])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef mat4_from_angles_into(float[::1] m, double x, double y, double z,
+                            double pitch, double yaw, double roll, bint view=0):
+    assert m.shape[0] == 16
+    cdef double sp = sin(pitch * DEG_TO_RAD), sy = sin(yaw * DEG_TO_RAD), sr = sin(roll * DEG_TO_RAD)
+    cdef double cp = cos(pitch * DEG_TO_RAD), cy = cos(yaw * DEG_TO_RAD), cr = cos(roll * DEG_TO_RAD)
+
+    m[0x0] = cy * cr
+    m[0x1] = sp * sy * cr + cp * sr
+    m[0x2] = sp * sr - cp * sy * cr
+    m[0x3] = 0
+    m[0x4] = -cy * sr
+    m[0x5] = cp * cr - sp * sy * sr
+    m[0x6] = cp * sy * sr + sp * cr
+    m[0x7] = 0
+    m[0x8] = sy
+    m[0x9] = -sp * cy
+    m[0xA] = cp * cy
+    m[0xB] = 0
+    if view:
+        m[0xC] = (cy * cr) * -x + (-cy * sr) * -y + sy * -z
+        m[0xD] = (sp * sy * cr + cp * sr) * -x + (cp * cr - sp * sy * sr) * -y + (-sp * cy) * -z
+        m[0xE] = (sp * sr - cp * sy * cr) * -x + (cp * sy * sr + sp * cr) * -y + (cp * cy) * -z
+    else:
+        m[0xC] = x
+        m[0xD] = y
+        m[0xE] = z
+    m[0xF] = 1
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from ctypes import c_char, sizeof
+
+CACHE_MAGIC = b'PUNYCACH'
+CACHE_VERSION = 1
+ALIGNMENT = 16
+
+# Set to False to bypass the on-disk cache, i.e. with --no-cache.
+enabled = True
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def __str__(self):
+        return '%d hits, %d misses' % (self.hits, self.misses)
+
+
+def cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'punyverse', 'cache')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/punyverse')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'punyverse')
+
+
+def cache_path(kind, *key):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), kind, digest)
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def stamps_valid(stamps):
+    try:
+        return all(file_stamp(path) == stamp for path, stamp in stamps)
+    except OSError:
+        return False
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _nbytes(buffer):
+    try:
+        return buffer.nbytes
+    except AttributeError:
+        pass
+    try:
+        return buffer.itemsize * len(buffer)
+    except AttributeError:
+        return sizeof(buffer)
+
+
+def write_cache(path, header, buffers):
+    if not enabled:
+        return False
+
+    blobs = []
+    offset = 0
+    for buffer in buffers:
+        size = _nbytes(buffer)
+        blobs.append((offset, size))
+        offset = _align(offset + size)
+
+    header = dict(header, version=CACHE_VERSION, byteorder=sys.byteorder, blobs=blobs)
+    encoded = json.dumps(header).encode('utf-8')
+    start = _align(len(CACHE_MAGIC) + 4 + len(encoded))
+
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(temp, 'wb') as f:
+            f.write(CACHE_MAGIC)
+            f.write(struct.pack('<I', len(encoded)))
+            f.write(encoded)
+            for buffer, (offset, size) in zip(buffers, blobs):
+                f.write(b'\0' * (start + offset - f.tell()))
+                f.write(buffer)
+
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+    except (IOError, OSError) as e:
+        print('Failed to write cache %s: %s' % (path, e))
+        if os.path.exists(temp):
+            os.remove(temp)
+        return False
+    return True
+
+
+def read_cache(path, validate=lambda header: True):
+    """Maps a cache file written by write_cache into memory.
+
+    Returns the header and a ctypes view into the mapping for every blob, or None if the
+    cache is missing, corrupted, stale according to validate, or from a different version."""
+    if not enabled:
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length).decode('utf-8'))
+            if header.get('version') != CACHE_VERSION or header.get('byteorder') != sys.byteorder:
+                return None
+            if not validate(header):
+                return None
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+    start = _align(len(CACHE_MAGIC) + 4 + length)
+    try:
+        views = [(c_char * size).from_buffer(mapping, start + offset) for offset, size in header['blobs']]
+    except ValueError:
+        return None
+    return header, views
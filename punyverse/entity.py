@@ -1,93 +1,395 @@
 import random
 from math import sqrt, pi
 
+import numpy
 from pyglet.gl import *
 # noinspection PyUnresolvedReferences
 from six.moves import range
 
 from punyverse.glgeom import *
-from punyverse.model import load_model, WavefrontVBO
+from punyverse.glgeom import empty_gl_buffer
+from punyverse.glstate import state
+from punyverse.model import decimate_model, load_model, WavefrontVBO
 from punyverse.orbit import KeplerOrbit
-from punyverse.texture import get_best_texture, load_alpha_mask, get_cube_map, load_texture_1d
-from punyverse.utils import cached_property
+from punyverse.render import BACKGROUND, OPAQUE, TRANSLUCENT
+from punyverse.texture import get_best_texture, load_alpha_mask, get_cube_map, load_texture_1d, texture_average
 
 G = 6.67384e-11  # Gravitation Constant
 
 
+class EntityStore(object):
+    """Keeps the state of every entity in contiguous arrays, one row per entity.
+
+    Rows are added parent first, so a satellite's row always comes after its parent's.
+    Entities are thin views over their rows, and update moves all of them at once."""
+
+    def __init__(self, capacity=64):
+        self.entities = []
+        self.location = numpy.zeros((capacity, 3))
+        self.direction = numpy.zeros((capacity, 3))
+        self.rotation = numpy.zeros((capacity, 3))
+        self.spin = numpy.zeros((capacity, 3))  # Added to the rotation every update
+        # Rotation axes that are a function of the tick instead: base + tick * rate
+        self.timed = numpy.zeros((capacity, 3), dtype=bool)
+        self.rotation_base = numpy.zeros((capacity, 3))
+        self.rotation_rate = numpy.zeros((capacity, 3))
+        self.radius = numpy.zeros(capacity)  # For collisions, 0 if it can't be collided with
+        self.extent = numpy.zeros(capacity)  # Radius of everything drawn for the entity itself
+        self.orbit_extent = numpy.zeros(capacity)  # Apoapsis of the orbit line drawn around the parent
+        self.parent = numpy.full(capacity, -1, dtype=numpy.intp)
+        self.orbit_row = numpy.full(capacity, -1, dtype=numpy.intp)
+        self.orbit_root = numpy.full(capacity, -1, dtype=numpy.intp)
+        self.tree = SphereTree(self)
+        self.draw_tree = SphereTree(self, 'extent', 'orbit_extent')
+        self._orbiting = None
+
+    def __len__(self):
+        return len(self.entities)
+
+    def _grow(self):
+        for name in ('location', 'direction', 'rotation', 'spin', 'timed', 'rotation_base', 'rotation_rate',
+                     'radius', 'extent', 'orbit_extent', 'parent', 'orbit_row', 'orbit_root'):
+            array = getattr(self, name)
+            grown = numpy.resize(array, (len(array) * 2,) + array.shape[1:])
+            grown[len(array):] = -1 if array.dtype == numpy.intp else 0
+            setattr(self, name, grown)
+
+    def add(self, entity, location, rotation, direction):
+        row = len(self.entities)
+        if row == len(self.location):
+            self._grow()
+        self.entities.append(entity)
+        self.location[row] = location
+        self.rotation[row] = rotation
+        self.direction[row] = direction
+        self.tree.invalidate()
+        self.draw_tree.invalidate()
+        return row
+
+    def set_orbit(self, row, parent, orbit_row, orbit_root):
+        self.parent[row] = parent
+        self.orbit_row[row] = orbit_row
+        self.orbit_root[row] = orbit_root
+        self.tree.invalidate()
+        self.draw_tree.invalidate()
+        self._orbiting = None
+
+    def set_timed_rotation(self, row, axis, base, rate):
+        self.timed[row, axis] = True
+        self.rotation_base[row, axis] = base
+        self.rotation_rate[row, axis] = rate
+
+    def update(self, tick, orbits):
+        self.advance(tick, orbits, self.location, self.rotation)
+        self.refit()
+
+    def advance(self, tick, orbits, location, rotation):
+        """Steps location and rotation, laid out like the store's own arrays, to tick."""
+        count = len(self.entities)
+        location = location[:count]
+        rotation = rotation[:count]
+
+        location += self.direction[:count]
+        rotation += self.spin[:count]
+        timed = self.timed[:count]
+        rotation[timed] = ((self.rotation_base[:count] + tick * self.rotation_rate[:count]) % 360)[timed]
+
+        # Orbit roots don't orbit, so they are already in place by now.
+        if self._orbiting is None:
+            self._orbiting = numpy.flatnonzero(self.orbit_row[:count] >= 0)
+        orbiting = self._orbiting
+        if len(orbiting):
+            location[orbiting] = location[self.orbit_root[orbiting]] + orbits.positions[self.orbit_row[orbiting]]
+
+    def refit(self):
+        self.tree.refit()
+        self.draw_tree.refit()
+
+    def collides(self, start, end):
+        return self.tree.collides(start, end)
+
+
+class SphereTree(object):
+    """Bounding sphere hierarchy over bodies and their satellite systems.
+
+    Every row of the EntityStore is a node, whose sphere is centred on its location and encloses it and
+    all its satellites. The structure follows the parent indices, and the spheres are refit every tick.
+
+    The radius of each entity itself is taken from the store array named by radius. If orbit names another,
+    it holds the radius of a sphere around the parent that the entity's orbit line must also fit in."""
+
+    def __init__(self, store, radius='radius', orbit=None):
+        self.store = store
+        self.radius = radius
+        self.orbit = orbit
+        self.bounds = numpy.zeros(0)
+        self.tests = 0  # Spheres tested by the last query
+        self._levels = None
+
+    def invalidate(self):
+        self._levels = None
+
+    def _build(self):
+        count = len(self.store)
+        parent = self.store.parent[:count]
+        depth = numpy.zeros(count, dtype=numpy.intp)
+        for row in range(count):  # Parents always come first
+            if parent[row] >= 0:
+                depth[row] = depth[parent[row]] + 1
+
+        # Deepest level first, for refitting.
+        self._levels = [numpy.flatnonzero(depth == level) for level in range(depth.max(initial=0), 0, -1)]
+        self._roots = numpy.flatnonzero(depth == 0)
+
+        children = numpy.flatnonzero(depth > 0)
+        children = children[numpy.argsort(parent[children], kind='stable')]
+        self._children = children
+        self._child_start = numpy.searchsorted(parent[children], numpy.arange(count))
+        self._child_end = numpy.searchsorted(parent[children], numpy.arange(count), side='right')
+
+    def refit(self):
+        if self._levels is None:
+            self._build()
+
+        store = self.store
+        count = len(store)
+        location = store.location[:count]
+        parent = store.parent[:count]
+        self.bounds = bounds = getattr(store, self.radius)[:count].copy()
+        orbit = getattr(store, self.orbit)[:count] if self.orbit else None
+        for rows in self._levels:
+            rows = rows[(bounds[rows] > 0) if orbit is None else (bounds[rows] > 0) | (orbit[rows] > 0)]
+            delta = location[rows] - location[parent[rows]]
+            reach = numpy.sqrt(numpy.einsum('ij,ij->i', delta, delta)) + bounds[rows]
+            if orbit is not None:
+                reach = numpy.maximum(reach, orbit[rows])
+            numpy.maximum.at(bounds, parent[rows], reach)
+
+    def visible(self, planes):
+        """Whether each node's sphere intersects the volume bounded by the planes, as from frustum_planes.
+
+        Nodes whose parent's sphere is outside are rejected along with it."""
+        store = self.store
+        if self._levels is None or len(self.bounds) != len(store):
+            self.refit()
+
+        count = len(store)
+        distance = store.location[:count].dot(planes[:, :3].T) + planes[:, 3]
+        inside = (distance >= -self.bounds[:, None]).all(axis=1)
+        parent = store.parent[:count]
+        for rows in reversed(self._levels):
+            inside[rows] &= inside[parent[rows]]
+        return inside
+
+    def collides(self, start, end):
+        """Whether the segment the camera moved along since the last query touches any body."""
+        start = numpy.asarray(start, dtype=numpy.float64)
+        segment = numpy.asarray(end, dtype=numpy.float64) - start
+        length = segment.dot(segment)
+
+        store = self.store
+        self.tests = 0
+        if len(self.bounds) != len(store):
+            self.refit()
+
+        nodes = self._roots[self.bounds[self._roots] > 0]
+        while len(nodes):
+            self.tests += len(nodes)
+            offset = store.location[nodes] - start
+            t = numpy.clip(offset.dot(segment) / length, 0, 1) if length else numpy.zeros(len(nodes))
+            offset -= t[:, None] * segment
+            distance = numpy.einsum('ij,ij->i', offset, offset)
+
+            radius = getattr(store, self.radius)[nodes]
+            if numpy.any((radius > 0) & (distance <= radius * radius)):
+                return True
+
+            hit = nodes[distance <= self.bounds[nodes] ** 2]
+            nodes = numpy.concatenate([self._children[self._child_start[node]:self._child_end[node]]
+                                       for node in hit] or [self._roots[:0]])
+            nodes = nodes[self.bounds[nodes] > 0]
+        return False
+
+
 class Entity(object):
+    __slots__ = ('world', 'name', 'row', 'model_matrix')
     background = False
 
     def __init__(self, world, name, location, rotation=(0, 0, 0), direction=(0, 0, 0)):
         self.world = world
         self.name = name
-        self.location = location
-        self.rotation = rotation
-        self.direction = direction
-
-    @cached_property
-    def model_matrix(self):
-        return Matrix4f.from_angles(self.location, self.rotation)
-
-    @cached_property
-    def mv_matrix(self):
-        return self.world.view_matrix() * self.model_matrix
-
-    @cached_property
-    def mvp_matrix(self):
-        return self.world.vp_matrix * self.model_matrix
-
-    def update(self):
-        self.model_matrix = None
-        self.mv_matrix = None
-        self.mvp_matrix = None
-        x, y, z = self.location
-        dx, dy, dz = self.direction
-        self.location = x + dx, y + dy, z + dz
+        self.row = world.entities.add(self, location, rotation, direction)
 
-    def collides(self, x, y, z):
-        return False
+        # Recomputed by the world every frame.
+        self.model_matrix = Matrix4f.zero()
 
-    def draw(self, options):
-        raise NotImplementedError()
+    def _get_row(self, array):
+        x, y, z = array[self.row]
+        return float(x), float(y), float(z)
 
+    @property
+    def location(self):
+        return self._get_row(self.world.entities.location)
 
-class Asteroid(Entity):
-    def __init__(self, world, model, location, direction):
-        super(Asteroid, self).__init__(world, 'Asteroid', location, direction=direction)
-        self.model = model
+    @location.setter
+    def location(self, value):
+        self.world.entities.location[self.row] = value
 
-    def update(self):
-        super(Asteroid, self).update()
-        rx, ry, rz = self.rotation
-        # Increment all axis to 'spin'
-        self.rotation = rx + 1, ry + 1, rz + 1
+    @property
+    def rotation(self):
+        return self._get_row(self.world.entities.rotation)
+
+    @rotation.setter
+    def rotation(self, value):
+        self.world.entities.rotation[self.row] = value
+
+    @property
+    def direction(self):
+        return self._get_row(self.world.entities.direction)
+
+    @direction.setter
+    def direction(self, value):
+        self.world.entities.direction[self.row] = value
+
+    def collides(self, x, y, z):
+        return False
 
     def draw(self, options):
-        shader = self.world.activate_shader('model')
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
-        shader.uniform_mat4('u_mvMatrix', self.mv_matrix)
-        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
-        self.model.draw(shader)
+        raise NotImplementedError()
 
 
-class AsteroidManager(object):
-    def __init__(self, world):
-        self.world = world
-        self.asteroids = []
+class AsteroidSystem(Entity):
+    """Pool of the asteroids the player throws, which are all drawn together.
+
+    Each asteroid is a slot in fixed-capacity arrays. When the pool is full, the oldest asteroid is recycled, and
+    asteroids despawn on their own once they are too old or too far from the camera. Every model has a region
+    of one dynamic instance buffer holding the location and rotation of its live asteroids, so all of them are
+    drawn with one instanced call per model."""
+    __slots__ = ('models', 'capacity', 'lifetime', 'despawn_distance', 'alive', 'model', 'age',
+                 'asteroid_location', 'asteroid_direction', 'asteroid_rotation', 'shown', 'counts', 'instance_buf',
+                 '_dirty')
+
+    type = GL_FLOAT
+    stride = 6 * 4
+    translate_offset = 0
+    translate_size = 3
+    rotation_offset = 3 * 4
+    rotation_size = 3
+
+    def __init__(self, world, capacity=256, lifetime=3600, despawn_distance=5):
+        super(AsteroidSystem, self).__init__(world, 'Asteroids', (0, 0, 0))
+        world.entities.extent[self.row] = float('inf')  # The asteroids can be anywhere
+        self.models = []
+        self.capacity = capacity
+        self.lifetime = lifetime  # In updates
+        self.despawn_distance = despawn_distance  # In AU
+        self.instance_buf = None
+        self.counts = []
+        self._dirty = False
+
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        self.model = numpy.zeros(capacity, dtype=numpy.intp)
+        self.age = numpy.zeros(capacity, dtype=numpy.intp)
+        self.asteroid_location = numpy.zeros((capacity, 3))
+        self.asteroid_direction = numpy.zeros((capacity, 3))
+        self.asteroid_rotation = numpy.zeros((capacity, 3))
+
+        # What gets drawn, as (alive, model, location, rotation). These are the arrays above, unless the
+        # simulation runs on another thread, which leaves the render thread to show interpolated copies.
+        self.shown = self.alive, self.model, self.asteroid_location, self.asteroid_rotation
 
     def __bool__(self):
-        return bool(self.asteroids)
+        return bool(self.models)
     __nonzero__ = __bool__
 
+    def __len__(self):
+        return int(self.alive.sum())
+
     def load(self, file):
-        shader = self.world.activate_shader('model')
-        self.asteroids.append(WavefrontVBO(load_model(file), shader, 5, 5, 5))
+        shader = self.world.activate_shader('asteroid')
+        self.models.append(WavefrontVBO(load_model(file, 5, 5, 5), shader))
+
+    def build(self):
+        """Allocates the instance buffer, once all models are loaded."""
+        self.instance_buf = empty_gl_buffer(len(self.models) * self.capacity * self.stride)
+
+        shader = self.world.activate_shader('asteroid')
+        for index, model in enumerate(self.models):
+            region = index * self.capacity * self.stride
+
+            def callback():
+                glBindBuffer(GL_ARRAY_BUFFER, self.instance_buf)
+                shader.vertex_attribute('a_translate', self.translate_size, self.type, GL_FALSE,
+                                        self.stride, region + self.translate_offset, divisor=1)
+                shader.vertex_attribute('a_rotation', self.rotation_size, self.type, GL_FALSE,
+                                        self.stride, region + self.rotation_offset, divisor=1)
+                glBindBuffer(GL_ARRAY_BUFFER, 0)
+            model.additional_attributes(callback)
+        self.counts = [0] * len(self.models)
+
+    def spawn(self, location, direction):
+        free = numpy.flatnonzero(~self.alive)
+        slot = free[0] if len(free) else numpy.argmax(self.age)
+        self.alive[slot] = True
+        self.model[slot] = random.randrange(len(self.models))
+        self.age[slot] = 0
+        self.asteroid_location[slot] = location
+        self.asteroid_direction[slot] = direction
+        self.asteroid_rotation[slot] = 0
+        self._dirty = True
+
+    def update(self, camera):
+        alive = self.alive
+        if not alive.any():
+            return
+
+        self.asteroid_location[alive] += self.asteroid_direction[alive]
+        # Increment all axis to 'spin'
+        self.asteroid_rotation[alive] += 1
+        self.age[alive] += 1
+
+        delta = self.asteroid_location - camera
+        limit = self.despawn_distance * self.world.au
+        alive &= (self.age < self.lifetime) & (numpy.einsum('ij,ij->i', delta, delta) < limit * limit)
+        self._dirty = True
+
+    def show(self, alive, model, location, rotation):
+        self.shown = alive, model, location, rotation
+        self._dirty = True
+
+    def _upload(self):
+        alive, model, location, rotation = self.shown
+        instances = numpy.zeros((len(self.models), self.capacity, 6), dtype=numpy.float32)
+        for index in range(len(self.models)):
+            rows = numpy.flatnonzero(alive & (model == index))
+            instances[index, :len(rows), :3] = location[rows]
+            instances[index, :len(rows), 3:] = rotation[rows]
+            self.counts[index] = len(rows)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buf)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, instances.nbytes, instances.ctypes.data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self._dirty = False
+
+    def draw(self, options):
+        if self.shown[0].any():
+            self.world.queue.submit(OPAQUE, 'asteroid', 0, 0, self._draw_instances)
 
-    def new(self, location, direction):
-        return Asteroid(self.world, random.choice(self.asteroids), location, direction)
+    def _draw_instances(self):
+        if self._dirty:
+            self._upload()
+
+        shader = self.world.activate_shader('asteroid')
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
+        for model, count in zip(self.models, self.counts):
+            if count:
+                model.draw(shader, instances=count)
 
 
 class Belt(Entity):
+    __slots__ = ('mean_motion', 'belt', 'objects', 'decimated', 'model_radius', 'lod_pixels', 'point_color',
+                 'points_vao', 'lod', 'epoch', 'meshes', 'points')
+
     def __init__(self, name, world, info):
         x = world.evaluate(info.get('x', 0))
         y = world.evaluate(info.get('y', 0))
@@ -99,48 +401,138 @@ class Belt(Entity):
         longitude = info.get('longitude', 0)
         inclination = info.get('inclination', 0)
         argument = info.get('argument', 0)
-        rotation = info.get('period', 31536000)
+        period = info.get('period', 31536000)
         models = info['model']
-        self.rotation_angle = 360.0 / rotation if rotation else 0
+        # In radians per tick, for an orbit at the radius of the belt. Every asteroid moves along its own orbit.
+        self.mean_motion = 2 * pi / period if period else 0
 
         shader = world.activate_shader('belt')
         if not isinstance(models, list):
             models = [models]
 
-        self.belt = BeltVBO(radius, cross, len(models), count)
-        self.objects = [
-            WavefrontVBO(load_model(model), shader, info.get('sx', scale),
-                         info.get('sy', scale), info.get('sz', scale))
-            for model in models
-        ]
-
-        def callback():
-            glBindBuffer(GL_ARRAY_BUFFER, vbo)
-            shader.vertex_attribute('a_translate', self.belt.location_size, self.belt.type, GL_FALSE,
-                                    self.belt.stride, self.belt.location_offset, divisor=1)
-            shader.vertex_attribute('a_scale', self.belt.scale_size, self.belt.type, GL_FALSE,
-                                    self.belt.stride, self.belt.scale_offset, divisor=1)
-            glBindBuffer(GL_ARRAY_BUFFER, 0)
-
-        for model, vbo, count in zip(self.objects, self.belt.vbo, self.belt.sizes):
-            model.additional_attributes(callback)
+        self.belt = BeltVBO(radius, cross, len(models), count, info.get('seed'))
+        data = [load_model(model, info.get('sx', scale), info.get('sy', scale), info.get('sz', scale))
+                for model in models]
+        self.objects = [WavefrontVBO(model, shader) for model in data]
+        self.decimated = [WavefrontVBO(decimate_model(model), shader) for model in data]
+        self.model_radius = max(object.radius for object in self.objects)
+        self.lod_pixels = info.get('lod_pixels', (12, 3))
+        self.point_color = info.get('point_color', (0.35, 0.32, 0.3))
+
+        shader = world.activate_shader('belt_points')
+        self.points_vao = VAO()
+        with self.points_vao:
+            self._instance_attributes(shader, 0)
+
+        self.lod = None
+        self.epoch = None
+        self.meshes = []
+        self.points = 0, 0
 
         super(Belt, self).__init__(world, name, (x, y, z), (inclination, longitude, argument))
+        world.entities.extent[self.row] = self.belt.extent + self.belt.max_scale * self.model_radius
+
+    def _instance_attributes(self, shader, first, divisor=None):
+        belt = self.belt
+        glBindBuffer(GL_ARRAY_BUFFER, belt.vbo)
+        shader.vertex_attribute('a_elements', belt.elements_size, belt.type, GL_FALSE,
+                                belt.stride, first + belt.elements_offset, divisor=divisor)
+        shader.vertex_attribute('a_angles', belt.angles_size, belt.type, GL_FALSE,
+                                belt.stride, first + belt.angles_offset, divisor=divisor)
+        shader.vertex_attribute('a_scale', belt.scale_size, belt.type, GL_FALSE,
+                                belt.stride, first + belt.scale_offset, divisor=divisor)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _chunk_lod(self):
+        """Picks how to draw every chunk: -1 if culled, 0 for full meshes, 1 for decimated ones, 2 for points."""
+        belt = self.belt
+        world = self.world
+        c = world.cam
+
+        matrix = numpy.array(self.model_matrix.matrix, dtype=numpy.float64).reshape(4, 4).T
+        centres, radii = belt.bounds(world.tick, self.mean_motion)
+        centres = centres.dot(matrix[:3, :3].T) + matrix[:3, 3]
+        radii += belt.max_scale * self.model_radius
+        planes = world.frustum
+        visible = (centres.dot(planes[:, :3].T) + planes[:, 3] >= -radii[:, None]).all(axis=1)
+
+        distance = numpy.maximum(numpy.linalg.norm(centres - (c.x, c.y, c.z), axis=1) - radii, c.znear)
+        pixels = self.model_radius * world.pixel_scale / distance
+        full, decimated = self.lod_pixels
+        lod = numpy.where(pixels >= full, 0, numpy.where(pixels >= decimated, 1, 2))
+        lod[~visible] = -1
+        return lod
+
+    def _gather(self, lod):
+        # Pack the instances of every level and model together, and point each mesh at its range.
+        belt = self.belt
+        shader = self.world.activate_shader('belt')
+        parts = []
+        offset = 0
+        self.meshes = []
+        for level, objects in enumerate((self.objects, self.decimated)):
+            chunks = numpy.flatnonzero(lod == level)
+            for index, object in enumerate(objects):
+                starts, ends = belt.ranges(chunks, index)
+                count = int((ends - starts).sum())
+                if not count:
+                    continue
+                parts.extend(belt.instances[start:end] for start, end in zip(starts, ends))
+
+                object.additional_attributes(lambda first=offset * belt.stride:
+                                             self._instance_attributes(shader, first, divisor=1))
+                self.meshes.append((object, count))
+                offset += count
+
+        # Points don't care about the model, so whole chunks are drawn.
+        chunks = numpy.flatnonzero(lod == 2)
+        starts, ends = belt.offsets[chunks * belt.objects], belt.offsets[(chunks + 1) * belt.objects]
+        parts.extend(belt.instances[start:end] for start, end in zip(starts, ends))
+        self.points = offset, int((ends - starts).sum())
+
+        if parts:
+            data = numpy.concatenate(parts)
+            glBindBuffer(GL_ARRAY_BUFFER, belt.vbo)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data.ctypes.data)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.lod = lod
+        self.epoch = self.belt.epoch
 
-    def update(self):
-        super(Belt, self).update()
-        pitch, yaw, roll = self.rotation
-        self.rotation = pitch, self.world.tick * self.rotation_angle % 360, roll
+    def _orbit_uniforms(self, shader):
+        shader.uniform_float('u_tick', self.world.tick)
+        shader.uniform_float('u_meanMotion', self.mean_motion)
+        shader.uniform_float('u_radius', self.belt.radius)
 
     def draw(self, options):
+        lod = self._chunk_lod()
+        if self.epoch != self.belt.epoch or not numpy.array_equal(lod, self.lod):
+            self._gather(lod)
+
+        queue = self.world.queue
+        depth = self.world.cam.distance(*self.location)
+        if self.meshes:
+            queue.submit(OPAQUE, 'belt', 0, depth, self._draw_meshes)
+        if self.points[1]:
+            queue.submit(OPAQUE, 'belt_points', 0, depth, self._draw_points)
+
+    def _draw_meshes(self):
         shader = self.world.activate_shader('belt')
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
-        shader.uniform_mat4('u_mvMatrix', self.mv_matrix)
         shader.uniform_mat4('u_modelMatrix', self.model_matrix)
-
-        for object, vbo, count in zip(self.objects, self.belt.vbo, self.belt.sizes):
+        self._orbit_uniforms(shader)
+        for object, count in self.meshes:
             object.draw(shader, instances=count)
 
+    def _draw_points(self):
+        shader = self.world.activate_shader('belt_points')
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
+        shader.uniform_float('u_size', self.model_radius * self.world.pixel_scale)
+        shader.uniform_vec3('u_color', *self.point_color)
+        self._orbit_uniforms(shader)
+        state.enable(GL_PROGRAM_POINT_SIZE)
+        with self.points_vao:
+            glDrawArrays(GL_POINTS, *self.points)
+        state.disable(GL_PROGRAM_POINT_SIZE)
+
 
 class Sky(Entity):
     background = True
@@ -151,6 +543,7 @@ class Sky(Entity):
         roll = world.evaluate(info.get('roll', 0))
 
         super(Sky, self).__init__(world, 'Sky', (0, 0, 0), [pitch, yaw, roll])
+        world.entities.extent[self.row] = float('inf')  # Never culled
 
         self.texture = get_best_texture(info['texture'], loader=get_cube_map, callback=callback)
         self.constellation = get_cube_map(info['constellation'])
@@ -165,28 +558,32 @@ class Sky(Entity):
             glBindBuffer(GL_ARRAY_BUFFER, 0)
 
     def draw(self, options):
-        cam = self.world.cam
+        self.world.queue.submit(BACKGROUND, 'sky', self.texture, 0, self._draw_sky, (options.constellations,))
+
+    def _draw_sky(self, constellations):
         shader = self.world.activate_shader('sky')
-        shader.uniform_mat4('u_mvpMatrix', self.world.projection_matrix() *
-                            Matrix4f.from_angles(rotation=(cam.pitch, cam.yaw, cam.roll)) *
-                            Matrix4f.from_angles(rotation=self.rotation))
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
 
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self.texture)
+        state.bind_texture(GL_TEXTURE_CUBE_MAP, self.texture)
         shader.uniform_texture('u_skysphere', 0)
 
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self.constellation)
+        state.active_texture(GL_TEXTURE1)
+        state.bind_texture(GL_TEXTURE_CUBE_MAP, self.constellation)
         shader.uniform_texture('u_constellation', 1)
 
-        shader.uniform_bool('u_lines', options.constellations)
+        shader.uniform_bool('u_lines', constellations)
 
         with self.vao:
             glDrawArrays(GL_TRIANGLES, 0, self.cube.vertex_count)
 
-        glActiveTexture(GL_TEXTURE0)
+        state.active_texture(GL_TEXTURE0)
 
 
 class Body(Entity):
+    __slots__ = ('parent', 'satellites', 'mass', 'orbit_show', 'orbit_blend', 'orbit_opaque', 'initial_roll',
+                 'orbit', 'orbit_speed', 'orbit_row', 'orbit_root', 'rotation_angle',
+                 'orbit_vbo', 'orbit_vao', 'orbit_cache', 'orbit_mvp')
+
     def __init__(self, name, world, info, parent=None):
         self.parent = parent
         self.satellites = []
@@ -211,6 +608,8 @@ class Body(Entity):
 
         self.orbit = None
         self.orbit_speed = None
+        self.orbit_row = None
+        self.orbit_root = self
 
         if parent:
             # Semi-major axis when actually displayed in virtual space
@@ -229,40 +628,34 @@ class Body(Entity):
             self.orbit = KeplerOrbit(distance / world.length, info.get('eccentricity', 0), info.get('inclination', 0),
                                      info.get('longitude', 0), info.get('argument', 0))
 
+            # Positions are solved by the world's orbit engine, relative to the topmost body that doesn't orbit.
+            self.orbit_root = parent.orbit_root
+            self.orbit_row = world.orbits.add(self.orbit, self.orbit_speed, parent.orbit_row, name)
+            world.entities.orbit_extent[self.row] = self.orbit.sma * (1 + self.orbit.eccentricity)
+
         self.rotation_angle = 360.0 / rotation if rotation else 0
 
+        world.entities.set_orbit(self.row, parent.row if parent else -1,
+                                 -1 if self.orbit_row is None else self.orbit_row, self.orbit_root.row)
+        if self.rotation_angle:
+            world.entities.set_timed_rotation(self.row, 2, roll, self.rotation_angle)
+
         # Orbit calculation
         self.orbit_vbo = None
         self.orbit_vao = None
         self.orbit_cache = None
+        self.orbit_mvp = None  # Set by the world every frame, if any satellite has an orbit
 
-    @cached_property
+    @property
     def orbit_matrix(self):
-        return self.world.view_matrix() * Matrix4f.from_angles(self.location)
-
-    def update(self):
-        super(Body, self).update()
-
-        if self.rotation_angle:
-            pitch, yaw, roll = self.rotation
-            roll = (self.initial_roll + self.world.tick * self.rotation_angle) % 360
-            self.rotation = pitch, yaw, roll
-
-        if self.orbit:
-            px, py, pz = self.parent.location
-            x, z, y = self.orbit.orbit(self.world.tick * self.orbit_speed % 360)
-            self.location = (x + px, y + py, z + pz)
-            self.orbit_matrix = None
-
-        for satellite in self.satellites:
-            satellite.update()
+        return Matrix4f.from_angles(self.location)
 
     def get_orbit(self, shader):
         if not self.orbit:
             return
 
-        # Cache key is the three orbital plane parameters and eccentricity
-        cache = (self.orbit.eccentricity, self.orbit.longitude, self.orbit.inclination, self.orbit.argument)
+        # Cache key is the orbital elements, which the ephemeris is also rebuilt from
+        cache = self.orbit.elements
         if self.orbit_cache == cache:
             return self.orbit_vbo, self.orbit_vao
 
@@ -288,28 +681,28 @@ class Body(Entity):
         solid = distance < self.parent.orbit_opaque
         alpha = 1 if solid else (1 - (distance - self.parent.orbit_opaque) / self.parent.orbit_blend)
         shader.uniform_vec4('u_color', 1, 1, 1, alpha)
-        shader.uniform_mat4('u_mvpMatrix', self.world.projection_matrix() * self.parent.orbit_matrix)
-
-        if not solid:
-            glEnable(GL_BLEND)
+        shader.uniform_mat4('u_mvpMatrix', self.parent.orbit_mvp)
 
         vbo, vao = self.get_orbit(shader)
         with vao:
             glDrawArrays(GL_LINE_LOOP, 0, vbo.vertex_count)
 
-        if not solid:
-            glDisable(GL_BLEND)
-
     def draw(self, options):
-        self._draw(options)
+        # The world only calls this if the whole system is potentially visible.
+        world = self.world
+        if world.visible[self.row]:
+            self._draw(options)
 
-        if options.orbit and self.orbit:
-            dist = self.world.cam.distance(*self.parent.location)
+        if options.orbit and self.orbit and world.orbit_visible[self.row]:
+            dist = world.cam.distance(*self.parent.location)
             if dist < self.parent.orbit_show:
-                self._draw_orbits(dist)
+                # Faded orbit lines are blended in.
+                phase = OPAQUE if dist < self.parent.orbit_opaque else TRANSLUCENT
+                world.queue.submit(phase, 'line', 0, dist, self._draw_orbits, (dist,))
 
         for satellite in self.satellites:
-            satellite.draw(options)
+            if world.system_visible[satellite.row]:
+                satellite.draw(options)
 
     def _draw(self, options):
         raise NotImplementedError()
@@ -324,18 +717,22 @@ class Body(Entity):
 class SphericalBody(Body):
     _sphere_cache = {}
 
+    # How far past a threshold a body must grow to go back to the finer level, so it doesn't flicker around one.
+    lod_hysteresis = 1.25
+
     @classmethod
-    def _get_sphere(cls, division, tangent=True):
-        if (division, tangent) in cls._sphere_cache:
-            return cls._sphere_cache[division, tangent]
-        cls._sphere_cache[division, tangent] = sphere = \
-            (TangentSphere if tangent else SimpleSphere)(division, division)
+    def _get_sphere(cls, tangent=True):
+        # Every division is a level of the same mesh, so there is only one of each kind.
+        if tangent in cls._sphere_cache:
+            return cls._sphere_cache[tangent]
+        cls._sphere_cache[tangent] = sphere = (TangentSphere if tangent else SimpleSphere)()
         return sphere
 
     def __init__(self, name, world, info, parent=None):
         super(SphericalBody, self).__init__(name, world, info, parent)
 
         self.radius = world.evaluate(info.get('radius', world.length)) / world.length
+        world.entities.radius[self.row] = self.radius
         division = info.get('division', max(min(int(self.radius / 8), 60), 10))
 
         self.light_source = info.get('light_source', False)
@@ -343,17 +740,27 @@ class SphericalBody(Body):
         self.type = info.get('type', 'planet')
 
         self.texture = get_best_texture(info['texture'])
+        self.average_color = None  # Read back from the texture the first time it is drawn as a point
         self.normal_texture = None
         self.specular_texture = None
         self.emission_texture = None
 
-        self.sphere = self._get_sphere(division, tangent=self.type == 'planet')
+        self.sphere = self._get_sphere(tangent=self.type == 'planet')
+        self.sphere_level = self.sphere.level(division)
         self.vao = VAO()
 
+        # Radii on screen, in pixels, below which the body is drawn as an impostor, then as a point.
+        self.lod_pixels = info.get('lod_pixels', (16, 1))
+        self.lod = 0  # 0 for the sphere, 1 for the impostor, 2 for the point
+        # Sizes on screen, in pixels, below which the secondary passes are skipped: the thickness of the glow,
+        # the radius of the body for the clouds, which are then drawn as part of the surface, and the ring's width.
+        self.pass_pixels = info.get('pass_pixels', (1, 48, 1))
+
         if self.type == 'planet':
             shader = self.world.activate_shader('planet')
             with self.vao:
                 glBindBuffer(GL_ARRAY_BUFFER, self.sphere.vbo)
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.sphere.index_buf)
                 shader.vertex_attribute('a_normal', self.sphere.direction_size, self.sphere.type, GL_FALSE,
                                         self.sphere.stride, self.sphere.direction_offset)
                 shader.vertex_attribute('a_tangent', self.sphere.tangent_size, self.sphere.type, GL_FALSE,
@@ -365,6 +772,7 @@ class SphericalBody(Body):
             shader = self.world.activate_shader('star')
             with self.vao:
                 glBindBuffer(GL_ARRAY_BUFFER, self.sphere.vbo)
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.sphere.index_buf)
                 shader.vertex_attribute('a_normal', self.sphere.direction_size, self.sphere.type, GL_FALSE,
                                         self.sphere.stride, self.sphere.direction_offset)
                 shader.vertex_attribute('a_uv', self.sphere.uv_size, self.sphere.type, GL_FALSE,
@@ -376,6 +784,7 @@ class SphericalBody(Body):
         self.atmosphere = None
         self.clouds = None
         self.ring = 0
+        extent = self.radius
 
         if 'normal_map' in info:
             self.normal_texture = get_best_texture(info['normal_map'])
@@ -395,11 +804,14 @@ class SphericalBody(Body):
             if cloud_texture is not None:
                 self.cloud_transparency = get_best_texture(cloud_texture, loader=load_alpha_mask)
                 self.cloud_radius = self.radius + 2
-                self.clouds = self._get_sphere(division, tangent=False)
+                extent = max(extent, self.cloud_radius)
+                self.clouds = self._get_sphere(tangent=False)
+                self.cloud_level = self.clouds.level(division)
                 self.cloud_vao = VAO()
                 shader = self.world.activate_shader('clouds')
                 with self.cloud_vao:
                     glBindBuffer(GL_ARRAY_BUFFER, self.clouds.vbo)
+                    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.clouds.index_buf)
                     shader.vertex_attribute('a_normal', self.clouds.direction_size, self.clouds.type, GL_FALSE,
                                             self.clouds.stride, self.clouds.direction_offset)
                     shader.vertex_attribute('a_uv', self.clouds.uv_size, self.clouds.type, GL_FALSE,
@@ -409,7 +821,9 @@ class SphericalBody(Body):
             if atm_texture is not None and atm_color is not None:
                 self.atm_texture = load_texture_1d(atm_texture, clamp=True)
                 self.atm_color = atm_color
+                self.atm_size = atm_size
                 self.atmosphere = Disk(self.radius, self.radius + atm_size, 30)
+                extent = max(extent, self.radius + atm_size)
                 self.atmosphere_vao = VAO()
                 shader = self.world.activate_shader('atmosphere')
                 with self.atmosphere_vao:
@@ -432,6 +846,8 @@ class SphericalBody(Body):
 
             self.ring_texture = load_texture_1d(info['ring'].get('texture'), clamp=True)
             self.ring = Disk(distance, distance + size, 30)
+            self.ring_size = size
+            extent = max(extent, distance + size)
 
             self.ring_vao = VAO()
             shader = self.world.activate_shader('ring')
@@ -443,26 +859,26 @@ class SphericalBody(Body):
                                         self.ring.stride, self.ring.u_offset)
                 glBindBuffer(GL_ARRAY_BUFFER, 0)
 
-    def _draw_planet(self):
+        world.entities.extent[self.row] = extent
+
+    def _draw_planet(self, clouds=False):
         shader = self.world.activate_shader('planet')
         shader.uniform_float('u_radius', self.radius)
         shader.uniform_mat4('u_modelMatrix', self.model_matrix)
-        shader.uniform_mat4('u_mvMatrix', self.mv_matrix)
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
 
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        state.bind_texture(GL_TEXTURE_2D, self.texture)
         shader.uniform_texture('u_planet.diffuseMap', 0)
 
         shader.uniform_bool('u_planet.hasNormal', self.normal_texture)
         if self.normal_texture:
-            glActiveTexture(GL_TEXTURE1)
-            glBindTexture(GL_TEXTURE_2D, self.normal_texture)
+            state.active_texture(GL_TEXTURE1)
+            state.bind_texture(GL_TEXTURE_2D, self.normal_texture)
             shader.uniform_texture('u_planet.normalMap', 1)
 
         shader.uniform_bool('u_planet.hasSpecular', self.specular_texture)
         if self.specular_texture:
-            glActiveTexture(GL_TEXTURE2)
-            glBindTexture(GL_TEXTURE_2D, self.specular_texture)
+            state.active_texture(GL_TEXTURE2)
+            state.bind_texture(GL_TEXTURE_2D, self.specular_texture)
             shader.uniform_texture('u_planet.specularMap', 2)
             shader.uniform_vec3('u_planet.specular', 1, 1, 1)
             shader.uniform_float('u_planet.shininess', 10)
@@ -472,8 +888,8 @@ class SphericalBody(Body):
 
         shader.uniform_bool('u_planet.hasEmission', self.emission_texture)
         if self.emission_texture:
-            glActiveTexture(GL_TEXTURE3)
-            glBindTexture(GL_TEXTURE_2D, self.emission_texture)
+            state.active_texture(GL_TEXTURE3)
+            state.bind_texture(GL_TEXTURE_2D, self.emission_texture)
             shader.uniform_texture('u_planet.emissionMap', 3)
             shader.uniform_vec3('u_planet.ambient', 0, 0, 0)
             shader.uniform_vec3('u_planet.emission', 1, 1, 1)
@@ -483,95 +899,164 @@ class SphericalBody(Body):
 
         shader.uniform_vec3('u_planet.diffuse', 1, 1, 1)
 
+        shader.uniform_bool('u_hasClouds', clouds)
+        if clouds:
+            state.active_texture(GL_TEXTURE4)
+            state.bind_texture(GL_TEXTURE_2D, self.cloud_transparency)
+            shader.uniform_texture('u_clouds', 4)
+
         with self.vao:
-            glDrawArrays(GL_TRIANGLE_STRIP, 0, self.sphere.vertex_count)
+            count, offset = self.sphere_level
+            glDrawElements(GL_TRIANGLES, count, self.sphere.index_type, offset)
 
-        glActiveTexture(GL_TEXTURE0)
+        state.active_texture(GL_TEXTURE0)
 
     def _draw_star(self):
         shader = self.world.activate_shader('star')
         shader.uniform_float('u_radius', self.radius)
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
 
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        state.bind_texture(GL_TEXTURE_2D, self.texture)
         shader.uniform_texture('u_emission', 0)
 
         with self.vao:
-            glDrawArrays(GL_TRIANGLE_STRIP, 0, self.sphere.vertex_count)
+            count, offset = self.sphere_level
+            glDrawElements(GL_TRIANGLES, count, self.sphere.index_type, offset)
 
-    def _draw_sphere(self):
+    def _draw_sphere(self, clouds=False):
         if self.type == 'planet':
-            self._draw_planet()
+            self._draw_planet(clouds)
         elif self.type == 'star':
             self._draw_star()
 
+    def _draw_impostor(self, pixels, clouds=False):
+        world = self.world
+        shader = world.activate_shader('impostor')
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
+        shader.uniform_float('u_radius', self.radius)
+        shader.uniform_float('u_pixels', pixels)
+        shader.uniform_float('u_ambient', 0.1)
+        shader.uniform_bool('u_emissive', self.type == 'star')
+
+        # The mip chain of the texture doubles as the low resolution albedo.
+        state.bind_texture(GL_TEXTURE_2D, self.texture)
+        shader.uniform_texture('u_albedo', 0)
+
+        shader.uniform_bool('u_hasClouds', clouds)
+        if clouds:
+            state.active_texture(GL_TEXTURE1)
+            state.bind_texture(GL_TEXTURE_2D, self.cloud_transparency)
+            shader.uniform_texture('u_clouds', 1)
+
+        with world.impostor.vao:
+            glDrawArrays(GL_TRIANGLE_STRIP, 0, world.impostor.vertex_count)
+
+        state.active_texture(GL_TEXTURE0)
+
+    def _draw_point(self, pixels):
+        if self.average_color is None:
+            self.average_color = texture_average(self.texture)
+
+        color = numpy.array(self.average_color)
+        if self.type != 'star':
+            # Dim by the lit fraction of the disk seen from the camera, with the sun at the origin.
+            c = self.world.cam
+            location = numpy.array(self.location)
+            sun, camera = -location, numpy.array([c.x, c.y, c.z]) - location
+            phase = sun.dot(camera) / max(numpy.linalg.norm(sun) * numpy.linalg.norm(camera), 1e-9)
+            color *= 0.1 + 0.9 * (1 + phase) / 2
+        self.world.points.add(self.location, color, max(2 * pixels, 1))
+
+    def _pick_lod(self, pixels):
+        lod = self.lod
+        while lod < len(self.lod_pixels) and pixels < self.lod_pixels[lod]:
+            lod += 1
+        while lod > 0 and pixels > self.lod_pixels[lod - 1] * self.lod_hysteresis:
+            lod -= 1
+        self.lod = lod
+        return lod
+
     def _draw_atmosphere(self):
-        glEnable(GL_BLEND)
-        glDisable(GL_CULL_FACE)
         shader = self.world.activate_shader('atmosphere')
+        shader.uniform_mat4('u_modelMatrix', self.model_matrix)
 
-        mv = self.mv_matrix.matrix
-        matrix = Matrix4f([1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, mv[12], mv[13], mv[14], 1])
-        shader.uniform_mat4('u_mvpMatrix', self.world.projection_matrix() * matrix)
-
-        glBindTexture(GL_TEXTURE_1D, self.atm_texture)
+        state.bind_texture(GL_TEXTURE_1D, self.atm_texture)
         shader.uniform_texture('u_transparency', 0)
         shader.uniform_vec3('u_color', *self.atm_color)
 
         with self.atmosphere_vao:
             glDrawArrays(GL_TRIANGLE_STRIP, 0, self.atmosphere.vertex_count)
 
-        glDisable(GL_BLEND)
-        glEnable(GL_CULL_FACE)
-
     def _draw_clouds(self):
-        glEnable(GL_BLEND)
         shader = self.world.activate_shader('clouds')
         shader.uniform_float('u_radius', self.cloud_radius)
         shader.uniform_mat4('u_modelMatrix', self.model_matrix)
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
 
-        glBindTexture(GL_TEXTURE_2D, self.cloud_transparency)
+        state.bind_texture(GL_TEXTURE_2D, self.cloud_transparency)
         shader.uniform_texture('u_transparency', 0)
         shader.uniform_vec3('u_diffuse', 1, 1, 1)
         shader.uniform_vec3('u_ambient', 0.1, 0.1, 0.1)
 
         with self.cloud_vao:
-            glDrawArrays(GL_TRIANGLE_STRIP, 0, self.clouds.vertex_count)
-
-        glDisable(GL_BLEND)
+            count, offset = self.cloud_level
+            glDrawElements(GL_TRIANGLES, count, self.clouds.index_type, offset)
 
     def _draw_rings(self):
-        glEnable(GL_BLEND)
-        glDisable(GL_CULL_FACE)
         shader = self.world.activate_shader('ring')
         shader.uniform_mat4('u_modelMatrix', self.model_matrix)
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
         shader.uniform_vec3('u_planet', *self.location)
-        shader.uniform_vec3('u_sun', 0, 0, 0)
         shader.uniform_float('u_planetRadius', self.radius)
         shader.uniform_float('u_ambient', 0.1)
 
-        glBindTexture(GL_TEXTURE_1D, self.ring_texture)
+        state.bind_texture(GL_TEXTURE_1D, self.ring_texture)
         shader.uniform_texture('u_texture', 0)
 
         with self.ring_vao:
             glDrawArrays(GL_TRIANGLE_STRIP, 0, self.ring.vertex_count)
 
-        glDisable(GL_BLEND)
-        glEnable(GL_CULL_FACE)
-
     def _draw(self, options):
-        self._draw_sphere()
+        world = self.world
+        pixels = world.pixel_radius(self.location, self.radius)
+        lod = self._pick_lod(pixels)
+        world.lod_counts[lod] += 1
+
+        atmosphere = options.atmosphere and self.atmosphere
+        clouds = options.cloud and self.clouds
+        if lod == 2:
+            # Nothing else on the body would cover a pixel either.
+            self._draw_point(pixels)
+            world.skipped_passes += bool(atmosphere) + bool(clouds) + bool(self.ring)
+            return
 
-        if options.atmosphere and self.atmosphere:
-            self._draw_atmosphere()
+        queue = world.queue
+        depth = world.cam.distance(*self.location)
+        atmosphere_pixels, cloud_pixels, ring_pixels = self.pass_pixels
+        scale = pixels / self.radius  # Pixels per unit of length at the body's depth
+        merge_clouds = bool(clouds) and (lod == 1 or pixels < cloud_pixels)
+        if lod == 1:
+            queue.submit(OPAQUE, 'impostor', self.texture, depth, self._draw_impostor, (pixels, merge_clouds))
+        else:
+            queue.submit(OPAQUE, self.type, self.texture, depth, self._draw_sphere, (merge_clouds,))
 
-        if options.cloud and self.clouds:
-            self._draw_clouds()
+        skipped = 0
+        if atmosphere:
+            if self.atm_size * scale >= atmosphere_pixels:
+                queue.submit(TRANSLUCENT, 'atmosphere', self.atm_texture, depth, self._draw_atmosphere, cull=False)
+            else:
+                skipped += 1
+
+        if clouds:
+            if merge_clouds:
+                skipped += 1
+            else:
+                queue.submit(TRANSLUCENT, 'clouds', self.cloud_transparency, depth, self._draw_clouds)
 
         if self.ring:
-            self._draw_rings()
+            if self.ring_size * scale >= ring_pixels:
+                queue.submit(TRANSLUCENT, 'ring', self.ring_texture, depth, self._draw_rings, cull=False)
+            else:
+                skipped += 1
+        world.skipped_passes += skipped
 
     def _collides(self, x, y, z):
         ox, oy, oz = self.location
@@ -586,12 +1071,14 @@ class ModelBody(Body):
 
         scale = info.get('scale', 1)
         shader = world.activate_shader('model')
-        self.vbo = WavefrontVBO(load_model(info['model']), shader, info.get('sx', scale),
-                                info.get('sy', scale), info.get('sz', scale))
+        self.vbo = WavefrontVBO(load_model(info['model'], info.get('sx', scale),
+                                           info.get('sy', scale), info.get('sz', scale)), shader)
+        world.entities.extent[self.row] = self.vbo.radius
 
     def _draw(self, options):
+        self.world.queue.submit(OPAQUE, 'model', 0, self.world.cam.distance(*self.location), self._draw_model)
+
+    def _draw_model(self):
         shader = self.world.activate_shader('model')
-        shader.uniform_mat4('u_mvpMatrix', self.mvp_matrix)
-        shader.uniform_mat4('u_mvMatrix', self.mv_matrix)
         shader.uniform_mat4('u_modelMatrix', self.model_matrix)
         self.vbo.draw(shader)
@@ -1,18 +1,71 @@
 from __future__ import division
 
 from array import array
-from ctypes import c_int, c_float, byref, cast, POINTER, c_uint, c_short, c_ushort
+from ctypes import c_int, c_float, byref, cast, sizeof, POINTER, c_uint, c_short, c_ushort
 from math import *
-from random import random, gauss, choice
 
+import numpy
 from pyglet.gl import *
 # noinspection PyUnresolvedReferences
 from six.moves import range
 
+from punyverse.cache import CacheStats, cache_path, read_cache, write_cache
+from punyverse.glstate import state
+
 TWOPI = pi * 2
 
+belt_cache_stats = CacheStats()
+
+try:
+    from punyverse._glgeom import mat4_multiply_into, mat4_multiply_batch, mat4_from_angles_into
+except ImportError:
+    # Unrolled by hand, since these run for every entity every frame.
+    def mat4_product(a, b):
+        a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12, a13, a14, a15 = a
+        b0, b1, b2, b3, b4, b5, b6, b7, b8, b9, b10, b11, b12, b13, b14, b15 = b
+        return array('f', (
+            a0 * b0 + a4 * b1 + a8 * b2 + a12 * b3,
+            a1 * b0 + a5 * b1 + a9 * b2 + a13 * b3,
+            a2 * b0 + a6 * b1 + a10 * b2 + a14 * b3,
+            a3 * b0 + a7 * b1 + a11 * b2 + a15 * b3,
+            a0 * b4 + a4 * b5 + a8 * b6 + a12 * b7,
+            a1 * b4 + a5 * b5 + a9 * b6 + a13 * b7,
+            a2 * b4 + a6 * b5 + a10 * b6 + a14 * b7,
+            a3 * b4 + a7 * b5 + a11 * b6 + a15 * b7,
+            a0 * b8 + a4 * b9 + a8 * b10 + a12 * b11,
+            a1 * b8 + a5 * b9 + a9 * b10 + a13 * b11,
+            a2 * b8 + a6 * b9 + a10 * b10 + a14 * b11,
+            a3 * b8 + a7 * b9 + a11 * b10 + a15 * b11,
+            a0 * b12 + a4 * b13 + a8 * b14 + a12 * b15,
+            a1 * b12 + a5 * b13 + a9 * b14 + a13 * b15,
+            a2 * b12 + a6 * b13 + a10 * b14 + a14 * b15,
+            a3 * b12 + a7 * b13 + a11 * b14 + a15 * b15,
+        ))
+
+
+    def mat4_multiply_into(out, a, b):
+        out[:] = mat4_product(a, b)
+
+
+    def mat4_multiply_batch(out, a, matrices):
+        for i in range(0, len(matrices), 16):
+            out[i:i + 16] = mat4_product(a, matrices[i:i + 16])
+
+
+    def mat4_from_angles_into(m, x, y, z, pitch, yaw, roll, view=False):
+        sp, sy, sr = sin(radians(pitch)), sin(radians(yaw)), sin(radians(roll))
+        cp, cy, cr = cos(radians(pitch)), cos(radians(yaw)), cos(radians(roll))
+        m0, m1, m2 = cy * cr, sp * sy * cr + cp * sr, sp * sr - cp * sy * cr
+        m4, m5, m6 = -cy * sr, cp * cr - sp * sy * sr, cp * sy * sr + sp * cr
+        m8, m9, m10 = sy, -sp * cy, cp * cy
+        if view:
+            x, y, z = (m0 * -x + m4 * -y + m8 * -z,
+                       m1 * -x + m5 * -y + m9 * -z,
+                       m2 * -x + m6 * -y + m10 * -z)
+        m[:] = array('f', (m0, m1, m2, 0, m4, m5, m6, 0, m8, m9, m10, 0, x, y, z, 1))
+
 __all__ = ['FontEngine', 'Matrix4f', 'Disk', 'OrbitVBO', 'SimpleSphere',
-           'TangentSphere', 'Cube', 'Circle', 'BeltVBO', 'VAO']
+           'TangentSphere', 'Cube', 'Circle', 'Quad', 'BeltVBO', 'VAO']
 
 
 def array_to_ctypes(arr):
@@ -25,11 +78,28 @@ def array_to_ctypes(arr):
     }[arr.typecode]))
 
 
+def empty_gl_buffer(size, usage=GL_DYNAMIC_DRAW):
+    vbo = c_uint()
+    glGenBuffers(1, byref(vbo))
+    glBindBuffer(GL_ARRAY_BUFFER, vbo.value)
+    glBufferData(GL_ARRAY_BUFFER, size, None, usage)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    return vbo.value
+
+
 def array_to_gl_buffer(buffer):
+    # Also accepts NumPy arrays, and ctypes arrays such as views into a memory-mapped cache file.
+    if isinstance(buffer, array):
+        size, data = buffer.itemsize * len(buffer), array_to_ctypes(buffer)
+    elif isinstance(buffer, numpy.ndarray):
+        size, data = buffer.nbytes, buffer.ctypes.data
+    else:
+        size, data = sizeof(buffer), buffer
+
     vbo = c_uint()
     glGenBuffers(1, byref(vbo))
     glBindBuffer(GL_ARRAY_BUFFER, vbo.value)
-    glBufferData(GL_ARRAY_BUFFER, buffer.itemsize * len(buffer), array_to_ctypes(buffer), GL_STATIC_DRAW)
+    glBufferData(GL_ARRAY_BUFFER, size, data, GL_STATIC_DRAW)
     glBindBuffer(GL_ARRAY_BUFFER, 0)
     return vbo.value
 
@@ -38,41 +108,41 @@ def list_to_gl_buffer(buffer, array_type='f'):
     return array_to_gl_buffer(array(array_type, buffer))
 
 
+def frustum_planes(matrix):
+    """Extracts the planes (a, b, c, d) of the view frustum from a view-projection Matrix4f.
+
+    The normals are unit length and point inwards, so a point p is inside if a*x + b*y + c*z + d >= 0."""
+    rows = numpy.array(matrix.matrix, dtype=numpy.float64).reshape(4, 4).T
+    planes = numpy.array([rows[3] + rows[0], rows[3] - rows[0], rows[3] + rows[1],
+                          rows[3] - rows[1], rows[3] + rows[2], rows[3] - rows[2]])
+    return planes / numpy.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
 class Matrix4f(object):
+    _zero = array('f', [0]) * 16
+
     def __init__(self, matrix):
         self.matrix = array('f', matrix)
         assert len(self.matrix) == 16
 
     @classmethod
-    def from_angles(cls, location=(0, 0, 0), rotation=(0, 0, 0), view=False):
-        m = [0] * 16
+    def _wrap(cls, matrix):
+        result = cls.__new__(cls)
+        result.matrix = matrix
+        return result
+
+    @classmethod
+    def zero(cls):
+        return cls._wrap(cls._zero[:])
+
+    @classmethod
+    def from_angles(cls, location=(0, 0, 0), rotation=(0, 0, 0), view=False, out=None):
+        if out is None:
+            out = cls.zero()
         x, y, z = location
         pitch, yaw, roll = rotation
-        sp, sy, sr = sin(radians(pitch)), sin(radians(yaw)), sin(radians(roll))
-        cp, cy, cr = cos(radians(pitch)), cos(radians(yaw)), cos(radians(roll))
-
-        m[0x0] = cy * cr
-        m[0x1] = sp * sy * cr + cp * sr
-        m[0x2] = sp * sr - cp * sy * cr
-        m[0x3] = 0
-        m[0x4] = -cy * sr
-        m[0x5] = cp * cr - sp * sy * sr
-        m[0x6] = cp * sy * sr + sp * cr
-        m[0x7] = 0
-        m[0x8] = sy
-        m[0x9] = -sp * cy
-        m[0xA] = cp * cy
-        m[0xB] = 0
-        if view:
-            m[0xC] = m[0x0] * -x + m[0x4] * -y + m[0x8] * -z
-            m[0xD] = m[0x1] * -x + m[0x5] * -y + m[0x9] * -z
-            m[0xE] = m[0x2] * -x + m[0x6] * -y + m[0xA] * -z
-        else:
-            m[0xC] = x
-            m[0xD] = y
-            m[0xE] = z
-        m[0xF] = 1
-        return cls(m)
+        mat4_from_angles_into(out.matrix, x, y, z, pitch, yaw, roll, view)
+        return out
 
     @property
     def _as_parameter_(self):
@@ -85,11 +155,22 @@ class Matrix4f(object):
     def __mul__(self, other):
         if not isinstance(other, Matrix4f):
             return NotImplemented
+        return self.multiply_into(other, self.zero())
+
+    def multiply_into(self, other, out):
+        """Stores self * other into out, which may be self or other, and returns it."""
+        mat4_multiply_into(out.matrix, self.matrix, other.matrix)
+        return out
 
-        rows = ((0, 4, 8, 12), (1, 5, 9, 13), (2, 6, 10, 14), (3, 7, 11, 15))
-        cols = ((0, 1, 2, 3), (4, 5, 6, 7), (8, 9, 10, 11), (12, 13, 14, 15))
-        a, b = self.matrix, other.matrix
-        return type(self)(sum(a[i] * b[j] for i, j in zip(r, c)) for c in cols for r in rows)
+    @classmethod
+    def batch_multiply(cls, matrix, matrices):
+        """Returns [matrix * m for m in matrices], computed in one call."""
+        packed = array('f')
+        for m in matrices:
+            packed.extend(m.matrix)
+        out = packed[:]
+        mat4_multiply_batch(out, matrix.matrix, packed)
+        return [cls._wrap(out[i:i + 16]) for i in range(0, len(out), 16)]
 
 
 class Circle(object):
@@ -115,6 +196,25 @@ class Circle(object):
             glBindBuffer(GL_ARRAY_BUFFER, 0)
 
 
+class Quad(object):
+    """A square from (-1, -1) to (1, 1), as a triangle strip, for billboards."""
+    type = GL_FLOAT
+    stride = 2 * 4
+    position_offset = 0
+    position_size = 2
+    vertex_count = 4
+
+    def __init__(self, shader):
+        self.vbo = list_to_gl_buffer([-1, -1, 1, -1, -1, 1, 1, 1])
+
+        self.vao = VAO()
+        with self.vao:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            shader.vertex_attribute('a_position', self.position_size, self.type, GL_FALSE,
+                                    self.stride, self.position_offset)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
 class Disk(object):
     type = GL_FLOAT
     stride = 3 * 4
@@ -125,56 +225,75 @@ class Disk(object):
 
     def __init__(self, rinner, router, segs):
         res = segs * 5
-        delta = 2 * pi / res
         self.vertex_count = (res + 1) * 2
-        # Need padding to make the last vertex render correctly... why?
-        buffer = self.vertex_count * 3 * [0]
-        for i in range(res):
-            theta = delta * i
-            x, y = cos(theta), sin(theta)
-            buffer[6*i:6*i+6] = [rinner * x, rinner * y, 0, router * x, router * y, 1]
-        buffer[6*res:6*res+6] = buffer[:6]
-        self.vbo = list_to_gl_buffer(buffer)
+        # The strip wraps around to its first pair of vertices to close the loop.
+        theta = numpy.arange(res + 1) % res * (2 * pi / res)
+        x, y = numpy.cos(theta), numpy.sin(theta)
+        buffer = numpy.empty((res + 1, 2, 3), dtype=numpy.float32)
+        buffer[:, 0] = numpy.column_stack([rinner * x, rinner * y, numpy.zeros(res + 1)])
+        buffer[:, 1] = numpy.column_stack([router * x, router * y, numpy.ones(res + 1)])
+        self.vbo = array_to_gl_buffer(buffer)
+
 
+class IndexedSphere(object):
+    """A unit sphere as a grid of vertices, with an index buffer holding a triangle list for every division.
 
-class SimpleSphere(object):
+    Every division that divides the grid's is a subset of its vertices, so bodies of any size share one VBO.
+    Subclasses lay out the vertices."""
     type = GL_FLOAT
+    index_type = GL_UNSIGNED_SHORT
+
+    def __init__(self, divisions=180):
+        self.divisions = divisions
+        theta, phi = numpy.meshgrid(numpy.linspace(0, pi, divisions + 1),
+                                    numpy.linspace(0, 2 * pi, divisions + 1), indexing='ij')
+        self.vbo = array_to_gl_buffer(self._vertices(theta, phi).astype(numpy.float32))
+
+        levels = [count for count in range(2, divisions + 1) if not divisions % count]
+        indices = []
+        self.levels = {}  # divisions -> (index count, byte offset)
+        offset = 0
+        for count in levels:
+            level = self._indices(count)
+            self.levels[count] = len(level), offset * 2
+            indices.append(level)
+            offset += len(level)
+        self.index_buf = array_to_gl_buffer(numpy.concatenate(indices).astype(numpy.uint16))
+
+    def _vertices(self, theta, phi):
+        raise NotImplementedError()
+
+    def _indices(self, count):
+        size = self.divisions + 1
+        step = self.divisions // count
+        rows, columns = numpy.meshgrid(numpy.arange(count) * step, numpy.arange(count) * step, indexing='ij')
+        a = rows * size + columns
+        b = a + step  # Next longitude
+        c = a + step * size  # Next latitude
+        d = c + step
+        # Counter-clockwise from the outside. At the poles, one triangle of each quad is degenerate, so leave it out.
+        return numpy.concatenate([numpy.stack([a, c, b], axis=-1)[1:].ravel(),
+                                  numpy.stack([b, c, d], axis=-1)[:-1].ravel()])
+
+    def level(self, divisions):
+        """Returns the index count and byte offset of the number of divisions closest to the one asked for."""
+        return self.levels[min(self.levels, key=lambda level: abs(level - divisions))]
+
+
+class SimpleSphere(IndexedSphere):
     stride = 5 * 4
     direction_offset = 0
     direction_size = 3
     uv_offset = direction_size * 4
     uv_size = 2
 
-    def __init__(self, lats, longs):
-        tau = pi * 2
-        phi_div = tau / longs
-        theta_div = pi / lats
-
-        self.vertex_count = (lats + 1) * (longs + 1) * 2
-        buffer = self.vertex_count * 5 * [0]
-        index = 0
-        reverse = False
-        for i in range(longs + 1):
-            phi1, phi2 = i * phi_div, (i + 1) * phi_div
-            if reverse:
-                phi1, phi2 = phi2, phi1
-            for j in range(lats + 1):
-                theta = j * theta_div
-                if reverse:
-                    theta = pi - theta
-                sine = sin(theta)
-                dz = cos(theta)
-                t = 1 - theta / pi
-                buffer[index:index + 10] = [sine * cos(phi2), sine * sin(phi2), dz, phi2 / tau, t,
-                                            sine * cos(phi1), sine * sin(phi1), dz, phi1 / tau, t]
-                index += 10
-            reverse ^= True
-
-        self.vbo = list_to_gl_buffer(buffer)
+    def _vertices(self, theta, phi):
+        sine = numpy.sin(theta)
+        return numpy.stack([sine * numpy.cos(phi), sine * numpy.sin(phi), numpy.cos(theta),
+                            phi / (2 * pi), 1 - theta / pi], axis=-1)
 
 
-class TangentSphere(object):
-    type = GL_FLOAT
+class TangentSphere(IndexedSphere):
     stride = 7 * 4
     direction_offset = 0
     direction_size = 3
@@ -183,35 +302,10 @@ class TangentSphere(object):
     uv_offset = tangent_offset + tangent_size * 4
     uv_size = 2
 
-    def __init__(self, lats, longs):
-        tau = pi * 2
-        phi_div = tau / longs
-        theta_div = pi / lats
-
-        self.vertex_count = (lats + 1) * (longs + 1) * 2
-        buffer = self.vertex_count * 8 * [0]
-        index = 0
-        reverse = False
-        for i in range(longs + 1):
-            phi1, phi2 = i * phi_div, (i + 1) * phi_div
-            if reverse:
-                phi1, phi2 = phi2, phi1
-            for j in range(lats + 1):
-                theta = j * theta_div
-                if reverse:
-                    theta = pi - theta
-                sine = sin(theta)
-                dz = cos(theta)
-                t = 1 - theta / pi
-                sphi2, cphi2 = sin(phi2), cos(phi2)
-                sphi1, cphi1 = sin(phi1), cos(phi1)
-                buffer[index:index + 14] = [
-                    sine * cphi2, sine * sphi2, dz, sine * -sphi2, sine * cphi2, phi2 / tau, t,
-                    sine * cphi1, sine * sphi1, dz, sine * -sphi1, sine * cphi1, phi1 / tau, t,
-                ]
-                index += 14
-            reverse ^= True
-        self.vbo = list_to_gl_buffer(buffer)
+    def _vertices(self, theta, phi):
+        sine, sphi, cphi = numpy.sin(theta), numpy.sin(phi), numpy.cos(phi)
+        return numpy.stack([sine * cphi, sine * sphi, numpy.cos(theta), sine * -sphi, sine * cphi,
+                            phi / (2 * pi), 1 - theta / pi], axis=-1)
 
 
 class Cube(object):
@@ -238,12 +332,9 @@ class OrbitVBO(object):
     vertex_count = 360
 
     def __init__(self, orbit):
-        buffer = 360 * 3 * [0]
-        for theta in range(360):
-            x, z, y = orbit.orbit(theta)
-            buffer[3*theta:3*theta+3] = [x, y, z]
-
-        self.vbo = list_to_gl_buffer(buffer)
+        # One vertex per degree of mean anomaly, looked up from the orbit's ephemeris.
+        positions = orbit.ephemeris().evaluate(numpy.radians(numpy.arange(self.vertex_count)))
+        self.vbo = array_to_gl_buffer(positions.astype(numpy.float32))
 
     def close(self):
         if self.vbo is not None:
@@ -310,40 +401,176 @@ class FontEngine(object):
 
 
 class BeltVBO(object):
-    type = GL_FLOAT
-    stride = 4 * 4
-    location_offset = 0
-    location_size = 3
-    scale_offset = location_size * 4
-    scale_size = 1
+    """Asteroids orbiting in a ring, split into chunks by band of semi-major axis and by sector of mean longitude.
 
-    def __init__(self, radius, cross, objects, count):
-        arrays = [array('f') for i in range(objects)]
+    Every instance carries its own orbital elements, and the shader moves it along its orbit. The instances are
+    kept sorted by chunk and then by model, so every (chunk, model) pair is a contiguous range of instances, from
+    offsets[chunk * objects + model] to the next offset. The instances to draw are gathered into the dynamic
+    buffer vbo.
 
-        for i in range(count):
-            theta = TWOPI * random()
-            r = gauss(radius, cross)
-            x, y, z = cos(theta) * r, gauss(0, cross), sin(theta) * r
-            scale = gauss(1, 0.5)
-            if scale < 0:
-                scale = 1
-            choice(arrays).extend((x, y, z, scale))
+    Inner orbits are faster, so the chunks spread out over time. Once they have spread by more than a sector,
+    the instances are sorted into chunks again by where they are at that point, the epoch."""
+    version = 2  # Of the instance layout, to tell cached belts apart
 
-        self.vbo = []
-        self.sizes = []
-        for a in arrays:
-            self.vbo.append(array_to_gl_buffer(a))
-            self.sizes.append(len(a) // 4)
+    type = GL_FLOAT
+    stride = 7 * 4
+    elements_offset = 0
+    elements_size = 4  # Semi-major axis, eccentricity, mean anomaly at tick 0, inclination
+    angles_offset = elements_size * 4
+    angles_size = 2  # Longitude of the ascending node, argument of periapsis
+    scale_offset = angles_offset + angles_size * 4
+    scale_size = 1
+
+    def __init__(self, radius, cross, objects, count, seed=None, sectors=32, bands=3):
+        self.radius = radius
+        self.objects = objects
+        self.sectors = sectors
+        self.bands = bands
+        self.chunks = sectors * bands
+        self.epoch = 0
+
+        # Only a seeded belt is the same every time, so only those are worth caching.
+        key = [self.version, radius, cross, objects, count, seed, sectors, bands]
+        path = cache_path('belt', *key) if seed is not None else None
+        cached = path and read_cache(path, lambda header: header['key'] == key)
+        if cached:
+            belt_cache_stats.hit()
+            header, views = cached
+            self.extent = header['extent']
+            self.max_scale = header['max_scale']
+            self.instances = numpy.frombuffer(views[0], dtype=numpy.float32).reshape(-1, 7)
+            self.models = numpy.frombuffer(views[1], dtype=numpy.int32)
+            self.offsets = numpy.frombuffer(views[2], dtype=numpy.int64)
+            self.chunk_orbits = numpy.frombuffer(views[3], dtype=numpy.float64).reshape(-1, 6)
+        else:
+            if path:
+                belt_cache_stats.miss()
+            self._generate(cross, count, seed)
+            self._chunk(0, 0)
+            if path:
+                write_cache(path, {'key': key, 'extent': self.extent, 'max_scale': self.max_scale},
+                            [self.instances, self.models, self.offsets, self.chunk_orbits])
+
+        self.vbo = empty_gl_buffer(self.instances.nbytes)
+
+    def _generate(self, cross, count, seed):
+        radius = self.radius
+        spread = cross / radius if radius else 0
+
+        # Eccentricities and inclinations are spread so the ring is about as thick as cross in every direction.
+        random = numpy.random.RandomState(seed)
+        sma = numpy.abs(random.normal(radius, cross, count))
+        eccentricity = numpy.minimum(numpy.abs(random.normal(0, spread / 2, count)), 0.9)
+        phase = random.uniform(0, TWOPI, count)
+        inclination = numpy.abs(random.normal(0, spread, count))
+        node = random.uniform(0, TWOPI, count)
+        argument = random.uniform(0, TWOPI, count)
+        scale = random.normal(1, 0.5, count)
+        scale[scale < 0] = 1
+
+        self.models = random.randint(self.objects, size=count).astype(numpy.int32)
+        self.instances = numpy.stack([sma, eccentricity, phase, inclination, node, argument, scale],
+                                     axis=1).astype(numpy.float32)
+        self.extent = float((sma * (1 + eccentricity)).max(initial=0))
+        self.max_scale = float(scale.max(initial=0))
+
+    def _chunk(self, epoch, mean_motion):
+        objects = self.objects
+        chunks = self.chunks
+        sectors = self.sectors
+        sma, eccentricity, phase, inclination, node, argument, scale = self.instances.T.astype(numpy.float64)
+
+        motion = mean_motion * (self.radius / sma) ** 1.5
+        longitude = (node + argument + phase + motion * epoch) % TWOPI
+        sector = numpy.minimum((longitude / TWOPI * sectors).astype(numpy.intp), sectors - 1)
+        if len(sma):
+            band = numpy.searchsorted(numpy.quantile(sma, numpy.linspace(0, 1, self.bands + 1)[1:-1]), sma)
+        else:
+            band = sector
+        chunk = band * sectors + sector
+
+        key = chunk * objects + self.models
+        order = numpy.argsort(key, kind='stable')
+        self.instances = self.instances[order]
+        self.models = self.models[order]
+        self.offsets = numpy.searchsorted(key[order], numpy.arange(chunks * objects + 1)).astype(numpy.int64)
+        self.epoch = epoch
+
+        # What bounds needs to know about the orbits in every chunk: the range of semi-major axes, the range of
+        # distances from the centre in the plane, the height above it, and how far the longitude in the plane
+        # can get ahead of or behind the mean longitude, due to eccentricity and inclination.
+        apoapsis = sma * (1 + eccentricity)
+        inclination = numpy.minimum(inclination, pi / 2)
+        orbits = numpy.zeros((chunks, 6))
+        orbits[:, 0] = orbits[:, 2] = numpy.inf
+        numpy.minimum.at(orbits[:, 0], chunk, sma)
+        numpy.maximum.at(orbits[:, 1], chunk, sma)
+        numpy.minimum.at(orbits[:, 2], chunk, sma * (1 - eccentricity) * numpy.cos(inclination))
+        numpy.maximum.at(orbits[:, 3], chunk, apoapsis)
+        numpy.maximum.at(orbits[:, 4], chunk, apoapsis * numpy.sin(inclination))
+        numpy.maximum.at(orbits[:, 5], chunk, 2.5 * eccentricity + numpy.arcsin(numpy.tan(inclination / 2) ** 2))
+        empty = numpy.isinf(orbits[:, 0])
+        orbits[empty] = [self.radius or 1, self.radius or 1, 0, 0, 0, 0]
+        self.chunk_orbits = orbits
+
+    def bounds(self, tick, mean_motion):
+        """Bounding spheres of every chunk at tick, as centres and radii in the plane of the belt.
+
+        mean_motion is in radians per tick, for an orbit with a semi-major axis of the belt's radius.
+        This sorts the instances into chunks again if they have spread out too much."""
+        width = TWOPI / self.sectors
+        sma_min, sma_max = self.chunk_orbits[:, 0], self.chunk_orbits[:, 1]
+        drift = mean_motion * ((self.radius / sma_min) ** 1.5 - (self.radius / sma_max) ** 1.5)
+        if (drift * abs(tick - self.epoch)).max(initial=0) > width:
+            self._chunk(tick, mean_motion)
+
+        sma_min, sma_max, low, high, height, slack = self.chunk_orbits.T
+        elapsed = tick - self.epoch
+        motion_min = mean_motion * (self.radius / sma_max) ** 1.5
+        motion_max = mean_motion * (self.radius / sma_min) ** 1.5
+
+        # Each chunk started out as a sector of mean longitude, which spreads out as inner orbits get ahead.
+        start = numpy.arange(self.chunks) % self.sectors * width
+        first = start + numpy.minimum(motion_min * elapsed, motion_max * elapsed) - slack
+        last = start + width + numpy.maximum(motion_min * elapsed, motion_max * elapsed) + slack
+        half = (last - first) / 2
+        middle = (first + last) / 2
+
+        # Centred in the middle of the annular sector, unless it covers more than half the ring.
+        wide = half >= pi / 2
+        centre = numpy.where(wide, 0, (low + high) / 2)
+        centres = numpy.stack([centre * numpy.cos(middle), numpy.zeros(self.chunks), centre * numpy.sin(middle)],
+                              axis=1)
+        # The distance to the centre is convex in the distance from the middle of the ring, so the farthest point
+        # is on the inner or outer edge, at the end of the sector.
+        cosine = 2 * centre * numpy.cos(numpy.minimum(half, pi / 2))
+        radii = numpy.sqrt(numpy.maximum(low * (low - cosine), high * (high - cosine)) + centre * centre +
+                           height * height)
+        return centres, radii
+
+    def ranges(self, chunks, model):
+        """The instance ranges of model in each of chunks."""
+        index = numpy.asarray(chunks, dtype=numpy.intp) * self.objects + model
+        return self.offsets[index], self.offsets[index + 1]
 
 
 class VAO(object):
     def __init__(self):
         buffer = GLuint()
         glGenVertexArrays(1, byref(buffer))
-        self.vao = buffer
+        self.vao = buffer.value
 
     def __enter__(self):
-        glBindVertexArray(self.vao)
+        state.bind_vertex_array(self.vao)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        glBindVertexArray(0)
+        # Within a frame, the next draw binds its own VAO anyway, and this saves unbinding in between.
+        if not state.in_frame:
+            state.bind_vertex_array(0)
+
+    def close(self):
+        if self.vao is not None:
+            if state.in_frame:
+                state.bind_vertex_array(0)
+            glDeleteVertexArrays(1, byref(GLuint(self.vao)))
+            self.vao = None
@@ -0,0 +1,92 @@
+from pyglet.gl import *
+
+
+class GLState(object):
+    """Shadows the OpenGL state that drawing changes the most, so calls that wouldn't change anything are dropped.
+
+    Every call through pyglet goes through ctypes, which adds up over a frame. This tracks the current program,
+    active texture unit, textures bound to each unit, the bound VAO and enabled capabilities. Program keeps the
+    values of its own uniforms, and counts them here too.
+
+    Anything that changes this state behind its back, like loading or streaming textures, has to happen outside
+    a frame, since begin_frame forgets everything."""
+
+    def __init__(self):
+        self.issued = 0  # Calls made this frame
+        self.elided = 0  # Calls dropped this frame for changing nothing
+        self.in_frame = False
+        self.invalidate()
+
+    def invalidate(self):
+        self._program = None
+        self._unit = None
+        self._textures = {}  # (unit, target) -> texture
+        self._vao = None
+        self._capabilities = {}  # capability -> enabled
+
+    def begin_frame(self):
+        self.invalidate()
+        self.issued = self.elided = 0
+        self.in_frame = True
+
+    def end_frame(self):
+        # Leave no VAO bound, so nothing else can change one by accident.
+        self.bind_vertex_array(0)
+        self.in_frame = False
+
+    def use_program(self, program):
+        if self._program == program:
+            self.elided += 1
+            return
+        glUseProgram(program)
+        self._program = program
+        self.issued += 1
+
+    def active_texture(self, unit):
+        if self._unit == unit:
+            self.elided += 1
+            return
+        glActiveTexture(unit)
+        self._unit = unit
+        self.issued += 1
+
+    def bind_texture(self, target, texture):
+        if self._unit is None:
+            self.active_texture(GL_TEXTURE0)
+        key = self._unit, target
+        if self._textures.get(key) == texture:
+            self.elided += 1
+            return
+        glBindTexture(target, texture)
+        self._textures[key] = texture
+        self.issued += 1
+
+    def bind_vertex_array(self, vao):
+        if self._vao == vao:
+            self.elided += 1
+            return
+        glBindVertexArray(vao)
+        self._vao = vao
+        self.issued += 1
+
+    def enable(self, capability):
+        if self._capabilities.get(capability) is True:
+            self.elided += 1
+            return
+        glEnable(capability)
+        self._capabilities[capability] = True
+        self.issued += 1
+
+    def disable(self, capability):
+        if self._capabilities.get(capability) is False:
+            self.elided += 1
+            return
+        glDisable(capability)
+        self._capabilities[capability] = False
+        self.issued += 1
+
+    def __str__(self):
+        return '%d issued, %d elided' % (self.issued, self.elided)
+
+
+state = GLState()
@@ -28,6 +28,16 @@ def main():
                         action='store_true')
     parser.add_argument('-S', '--no-sky', help='Disables the sky', dest='sky',
                         action='store_false')
+    parser.add_argument('--no-cache', help='Disables the on-disk asset cache', dest='cache',
+                        action='store_false')
+    parser.add_argument('--obj-parser', help='Wavefront OBJ parser to use on cache misses',
+                        choices=('numpy', 'python'), default='numpy')
+    parser.add_argument('--compress-textures', help='Caches textures compressed by the driver',
+                        action='store_true')
+    parser.add_argument('--stream-textures', help='Streams in full resolution textures after loading',
+                        action='store_true')
+    parser.add_argument('--simulation-rate', help='Simulates the world on its own thread at this many steps '
+                        'per second', type=int, default=0)
     args = parser.parse_args()
 
     versioning = dict(major_version=3, minor_version=3)
@@ -53,6 +63,13 @@ def main():
 
     from pyglet.gl import gl_info
 
+    from punyverse import cache, model, simulation, texture
+    cache.enabled = args.cache
+    model.default_parser = args.obj_parser
+    texture.compress_textures = args.compress_textures
+    texture.streaming = args.stream_textures
+    simulation.rate = args.simulation_rate
+
     from punyverse.loader import LoaderWindow, LoaderConsole
     from punyverse.ui import Punyverse
 
@@ -1,16 +1,21 @@
 import bz2
 import gzip
 import os
+import re
 import zipfile
 from collections import defaultdict
 
+import numpy
 import six
 from pyglet.gl import *
 # noinspection PyUnresolvedReferences
 from six.moves import range, zip
 
-from punyverse.glgeom import list_to_gl_buffer, VAO
+from punyverse.cache import CacheStats, cache_path, file_stamp, stamps_valid, read_cache, write_cache
+from punyverse.glgeom import array_to_gl_buffer, VAO
+from punyverse.glstate import state
 from punyverse.texture import load_texture
+from punyverse.utils import prefetcher
 
 
 def zip_open(file):
@@ -54,6 +59,19 @@ class Group(object):
         self.faces = faces or []
 
 
+class ArrayGroup(object):
+    """A group whose faces are stored as arrays.
+
+    corners holds the (vertex, normal, texture) indices of every face corner, with -1 for missing
+    indices, and sizes holds the number of corners in each face."""
+    __slots__ = ('material', 'corners', 'sizes')
+
+    def __init__(self, material=None):
+        self.material = material
+        self.corners = numpy.zeros((0, 3), dtype=numpy.int64)
+        self.sizes = numpy.zeros(0, dtype=numpy.int64)
+
+
 class WavefrontObject(object):
     def __init__(self, path):
         self.path = path
@@ -63,6 +81,7 @@ class WavefrontObject(object):
         self.textures = []
         self.groups = []
         self.materials = {}
+        self.files = []
 
         self.perform_io(self.path)
 
@@ -155,6 +174,7 @@ class WavefrontObject(object):
     def perform_io(self, file):
         ext = os.path.splitext(file)[1].lstrip('.')
         reader = openers.get(ext, lambda x: open(x, 'rb'))(file)
+        self.files.append(file)
 
         dispatcher = {
             b'v': self.vertex,
@@ -185,15 +205,356 @@ class WavefrontObject(object):
         return True
 
 
-model_base = os.path.join(os.path.dirname(__file__), 'assets', 'models')
+def _gather(tokens, starts, counts):
+    """Concatenates the runs of tokens of the given starts and lengths."""
+    offsets = numpy.cumsum(counts) - counts
+    return tokens[numpy.arange(counts.sum()) - numpy.repeat(offsets - starts, counts)]
+
+
+def _float_columns(tokens, starts, counts, columns):
+    result = numpy.zeros((len(starts), columns))
+    for i in range(columns):
+        present = counts > i
+        result[present, i] = tokens[starts[present] + i].astype(numpy.float64)
+    return result
 
 
-def load_model(path):
+def _parse_corners(tokens):
+    corners = numpy.full((len(tokens), 3), -1, dtype=numpy.int64)
+    if not len(tokens):
+        return corners
+
+    # Turn v/t/ into v/t/0, so that every corner has as many indices as slashes plus one.
+    trailing = numpy.char.endswith(tokens, b'/')
+    if trailing.any():
+        tokens = numpy.where(trailing, numpy.char.add(tokens, b'0'), tokens)
+
+    # Sized so every token is followed by at least one NUL, which becomes a separator.
+    tokens = tokens.astype('S%d' % (numpy.char.str_len(tokens).max() + 1))
+    slashes = numpy.char.count(tokens, b'/')
+
+    # Columns in corners for v, v/t and v/t/n, where 0 means a missing index.
+    for count, columns in ((0, [0]), (1, [0, 2]), (2, [0, 2, 1])):
+        present = slashes == count
+        if not present.any():
+            continue
+        text = tokens[present].tobytes().replace(b'//', b'/0/').replace(b'/', b' ').replace(b'\0', b' ')
+        indices = numpy.fromstring(text, dtype=numpy.int64, sep=' ').reshape(-1, count + 1)
+        corners[numpy.ix_(present, columns)] = indices - 1
+    return corners
+
+
+class NumpyWavefrontObject(WavefrontObject):
+    """Parses the whole file at once into NumPy arrays.
+
+    Produces the same groups and materials as WavefrontObject, but vertices, normals and
+    texture coordinates are arrays, and groups are ArrayGroup instead of lists of Face."""
+    _structure = [b'g', b'o', b'usemtl', b'mtllib']
+
+    def __init__(self, path):
+        self.current_group = None
+        super(NumpyWavefrontObject, self).__init__(path)
+
+    def material(self, words):
+        WavefrontObject.perform_io(self, os.path.join(self.root, words[1].decode('utf-8')))
+
+    def group(self, words):
+        group = ArrayGroup()
+        self.groups.append(group)
+        self.current_group = group
+
+    def faces(self, corners, sizes):
+        if not len(sizes):
+            return
+
+        if self.current_group is None:
+            self.group(None)
+        group = self.current_group
+        group.corners = numpy.concatenate([group.corners, corners])
+        group.sizes = numpy.concatenate([group.sizes, sizes])
+
+    def perform_io(self, file):
+        ext = os.path.splitext(file)[1].lstrip('.')
+        reader = openers.get(ext, lambda x: open(x, 'rb'))(file)
+        self.files.append(file)
+
+        with reader:
+            data = reader.read()
+
+        # Comments are dropped and every line end becomes a token, so the whole file is tokenized at once.
+        tokens = numpy.array(re.sub(br'#[^\n]*', b'', data).replace(b'\n', b' \1 ').split() + [b'\1'])
+        ends = numpy.flatnonzero(tokens == b'\1')
+        firsts = numpy.append(0, ends[:-1] + 1)
+        lines = firsts < ends
+        firsts, counts = firsts[lines], ends[lines] - firsts[lines] - 1
+        keywords = tokens[firsts]
+
+        def records(keyword):
+            selected = keywords == keyword
+            return tokens, firsts[selected] + 1, counts[selected]
+
+        self.vertices = _float_columns(*records(b'v'), columns=3)
+        self.normals = _float_columns(*records(b'vn'), columns=3)
+        self.textures = _float_columns(*records(b'vt'), columns=2)
+        # OBJ origin is at upper left, OpenGL origin is at lower left
+        self.textures[:, 1] = numpy.where(records(b'vt')[2] >= 2, 1 - self.textures[:, 1], 0)
+
+        faces = keywords == b'f'
+        sizes = counts[faces]
+        corners = _parse_corners(_gather(tokens, firsts[faces] + 1, sizes))
+        corner_offsets = numpy.append(0, numpy.cumsum(sizes))
+
+        dispatcher = {
+            b'mtllib': self.material,
+            b'usemtl': self.use_material,
+            b'g': self.group,
+            b'o': self.group,
+        }
+
+        # Faces are added in bulk between the statements that change the current group.
+        structure = numpy.flatnonzero(numpy.isin(keywords, self._structure))
+        face_lines = numpy.flatnonzero(faces)
+        bounds = numpy.append(numpy.searchsorted(face_lines, structure), len(face_lines))
+        start = 0
+        for line, end in zip(list(structure) + [None], bounds.tolist()):
+            self.faces(corners[corner_offsets[start]:corner_offsets[end]], sizes[start:end])
+            start = end
+            if line is not None:
+                words = tokens[firsts[line]:firsts[line] + counts[line] + 1].tolist()
+                dispatcher[words[0]](words)
+        return True
+
+
+index_dtypes = {
+    GL_UNSIGNED_SHORT: numpy.uint16,
+    GL_UNSIGNED_INT: numpy.uint32,
+}
+
+
+class MeshGroup(object):
+    __slots__ = ('material', 'has_normal', 'has_texture', 'offset_type', 'vertices', 'indices', 'vertex_count')
+
+    def __init__(self, material, has_normal, has_texture, offset_type, vertices, indices, vertex_count):
+        self.material = material
+        self.has_normal = has_normal
+        self.has_texture = has_texture
+        self.offset_type = offset_type
+        self.vertices = vertices
+        self.indices = indices
+        self.vertex_count = vertex_count
+
+
+class ModelData(object):
+    """A model processed into interleaved vertex and index buffers, ready to be uploaded."""
+    __slots__ = ('root', 'materials', 'groups')
+
+    def __init__(self, root, materials, groups):
+        self.root = root
+        self.materials = materials
+        self.groups = groups
+
+
+def group_arrays(group):
+    if isinstance(group, ArrayGroup):
+        return group.corners, group.sizes
+
+    corners = numpy.array([(v, -1 if n is None else n, -1 if t is None else t) for f in group.faces
+                           for v, n, t in zip(f.verts, f.norms, f.texs)], dtype=numpy.int64).reshape(-1, 3)
+    sizes = numpy.array([f.size for f in group.faces], dtype=numpy.int64)
+    return corners, sizes
+
+
+def merge_groups(model):
+    by_mat = defaultdict(list)
+    for g in model.groups:
+        corners, sizes = group_arrays(g)
+        if len(sizes):
+            by_mat[g.material].append((corners, sizes))
+
+    groups = []
+    for mat, arrays in six.iteritems(by_mat):
+        group = ArrayGroup(mat)
+        group.corners = numpy.concatenate([corners for corners, sizes in arrays])
+        group.sizes = numpy.concatenate([sizes for corners, sizes in arrays])
+        groups.append(group)
+    return groups
+
+
+def process_group(group, vertices, normals, textures, scale):
+    vertices = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+    normals = numpy.asarray(normals, dtype=numpy.float64).reshape(-1, 3)
+    textures = numpy.asarray(textures, dtype=numpy.float64).reshape(-1, 2)
+    corners = group.corners.copy()
+    sizes = group.sizes
+
+    has_texture = bool(len(textures)) and bool((corners[:, 2] >= 0).any())
+    has_normal = bool(len(normals)) and bool((corners[:, 1] >= 0).any())
+
+    # Blender defines texture coordinates on faces even without textures.
+    corners[corners[:, 2] >= len(textures), 2] = -1
+
+    # Deduplicate (v, n, t) triples, numbering them in order of first appearance.
+    unique, first, inverse = numpy.unique(corners, axis=0, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    remap = rank[inverse.ravel()]
+    v, n, t = corners[first[order]].T
+
+    columns = [vertices[v] * numpy.array(scale, dtype=numpy.float64)]
+    if has_normal:
+        columns.append(numpy.where((n >= 0)[:, None], normals[n], 0))
+    if has_texture:
+        columns.append(numpy.where((t >= 0)[:, None], textures[t], 0))
+    buffer = numpy.hstack(columns).astype(numpy.float32).ravel()
+
+    # Triangulate every face as a fan around its first corner.
+    starts = numpy.cumsum(sizes) - sizes
+    triangles = numpy.maximum(sizes - 2, 0)
+    face = numpy.repeat(numpy.arange(len(sizes)), triangles)
+    corner = numpy.arange(triangles.sum()) - numpy.repeat(numpy.cumsum(triangles) - triangles, triangles) + 1
+    fan = starts[face]
+    indices = remap[numpy.stack([fan, fan + corner, fan + corner + 1], axis=1)].ravel()
+
+    offset_type = GL_UNSIGNED_SHORT if len(order) < 65536 else GL_UNSIGNED_INT
+    return MeshGroup(group.material, has_normal, has_texture, offset_type, buffer,
+                     indices.astype(index_dtypes[offset_type]), len(indices))
+
+
+def process_model(model, scale):
+    groups = [process_group(group, model.vertices, model.normals, model.textures, scale)
+              for group in merge_groups(model)]
+    return ModelData(model.root, model.materials, groups)
+
+
+def decimate_group(group, cells):
+    stride = 3 + 3 * group.has_normal + 2 * group.has_texture
+    vertices = numpy.frombuffer(group.vertices, numpy.float32).reshape(-1, stride)
+    indices = numpy.frombuffer(group.indices, index_dtypes[group.offset_type])[:group.vertex_count]
+
+    # Cluster the vertices on a grid over the bounding box, and merge each cluster into its average.
+    positions = vertices[:, :3]
+    low = positions.min(axis=0, initial=0)
+    size = (positions.max(axis=0, initial=0) - low).max() / cells or 1
+    cell = numpy.minimum(((positions - low) / size).astype(numpy.intp), cells - 1)
+    unique, remap = numpy.unique((cell[:, 0] * cells + cell[:, 1]) * cells + cell[:, 2], return_inverse=True)
+    merged = numpy.zeros((len(unique), stride))
+    numpy.add.at(merged, remap.ravel(), vertices)
+    merged /= numpy.bincount(remap.ravel())[:, None]
+    if group.has_normal:
+        normals = merged[:, 3:6]
+        normals /= numpy.maximum(numpy.linalg.norm(normals, axis=1), 1e-9)[:, None]
+
+    # Triangles whose corners fell into the same cluster have collapsed.
+    triangles = remap.ravel()[indices].reshape(-1, 3)
+    triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) &
+                          (triangles[:, 0] != triangles[:, 2])]
+
+    offset_type = GL_UNSIGNED_SHORT if len(unique) < 65536 else GL_UNSIGNED_INT
+    return MeshGroup(group.material, group.has_normal, group.has_texture, offset_type,
+                     merged.astype(numpy.float32).ravel(), triangles.astype(index_dtypes[offset_type]).ravel(),
+                     triangles.size)
+
+
+def decimate_model(model, cells=6):
+    """A cheaper version of a processed model, for drawing far away, with vertices clustered on a grid."""
+    return ModelData(model.root, model.materials, [decimate_group(group, cells) for group in model.groups])
+
+
+model_base = os.path.join(os.path.dirname(__file__), 'assets', 'models')
+cache_stats = CacheStats()
+
+parsers = {
+    'python': WavefrontObject,
+    'numpy': NumpyWavefrontObject,
+}
+# Which of the parsers to use on a cache miss, i.e. with --obj-parser.
+default_parser = 'numpy'
+
+
+def read_model_cache(file, path, scale):
+    def validate(header):
+        return header['path'] == path and header['scale'] == list(scale) and stamps_valid(header['depends'])
+
+    cached = read_cache(file, validate)
+    if cached is None:
+        return None
+    header, views = cached
+
+    materials = {}
+    for name, info in six.iteritems(header['materials']):
+        materials[name] = Material(name, info['texture'], tuple(info['Ka']), tuple(info['Kd']),
+                                   tuple(info['Ks']), info['shininess'])
+
+    groups = []
+    for info, vertices, indices in zip(header['groups'], views[::2], views[1::2]):
+        groups.append(MeshGroup(materials.get(info['material']), info['has_normal'], info['has_texture'],
+                                info['offset_type'], vertices, indices, info['vertex_count']))
+    return ModelData(header['root'], materials, groups)
+
+
+def write_model_cache(file, path, scale, model, data):
+    header = {
+        'path': path,
+        'scale': list(scale),
+        'root': data.root,
+        'depends': [(name, file_stamp(name)) for name in model.files],
+        'materials': dict((name, {
+            'texture': material.texture,
+            'Ka': material.Ka,
+            'Kd': material.Kd,
+            'Ks': material.Ks,
+            'shininess': material.shininess,
+        }) for name, material in six.iteritems(data.materials)),
+        'groups': [{
+            'material': group.material.name if group.material else None,
+            'has_normal': group.has_normal,
+            'has_texture': group.has_texture,
+            'offset_type': group.offset_type,
+            'vertex_count': group.vertex_count,
+        } for group in data.groups],
+    }
+    buffers = []
+    for group in data.groups:
+        buffers += [group.vertices, group.indices]
+    write_cache(file, header, buffers)
+
+
+def model_path(path):
     if not os.path.isabs(path):
         path = os.path.join(model_base, path)
     if isinstance(path, six.binary_type):
         path = path.decode('mbcs' if os.name == 'nt' else 'utf8')
-    return WavefrontObject(path)
+    return path
+
+
+def read_model(path, scale):
+    file = cache_path('models', path, scale)
+    data = read_model_cache(file, path, scale)
+    if data is not None:
+        print('Loading model %s... cached' % path)
+        cache_stats.hit()
+        return data
+
+    print('Loading model %s...' % path)
+    cache_stats.miss()
+    model = parsers[default_parser](path)
+    data = process_model(model, scale)
+    write_model_cache(file, path, scale, model, data)
+    return data
+
+
+def load_model(path, sx=1, sy=1, sz=1):
+    path = model_path(path)
+    scale = (sx, sy, sz)
+    return prefetcher.take(('model', path, scale), read_model, path, scale)
+
+
+def prefetch_model(path, sx=1, sy=1, sz=1):
+    """Starts loading a model on a worker thread, to be picked up by load_model."""
+    path = model_path(path)
+    scale = (sx, sy, sz)
+    prefetcher.submit(('model', path, scale), read_model, path, scale)
 
 
 class ModelVBO(object):
@@ -231,21 +592,28 @@ class ModelVBO(object):
 
 
 class WavefrontVBO(object):
-    def __init__(self, model, shader, sx=1, sy=1, sz=1):
+    def __init__(self, model, shader):
         self._tex_cache = {}
         self.vbos = []
-        self.scale = (sx, sy, sz)
+        self.radius = 0  # Of the bounding sphere around the origin
 
         for m, material in six.iteritems(model.materials):
             if material.texture and material.texture not in self._tex_cache:
                 self._tex_cache[material.texture] = load_texture(os.path.join(model.root, material.texture))
 
-        vertices = model.vertices
-        textures = model.textures
-        normals = model.normals
-
-        for group in self.merge_groups(model):
-            processed = self.process_group(group, vertices, normals, textures)
+        for group in model.groups:
+            stride = 3 + 3 * group.has_normal + 2 * group.has_texture
+            positions = numpy.frombuffer(group.vertices, numpy.float32).reshape(-1, stride)[:, :3]
+            if len(positions):
+                self.radius = max(self.radius, float(numpy.sqrt(numpy.einsum('ij,ij->i', positions, positions).max())))
+
+            processed = ModelVBO()
+            processed.has_normal = group.has_normal
+            processed.has_texture = group.has_texture
+            processed.offset_type = group.offset_type
+            processed.data_buf = array_to_gl_buffer(group.vertices)
+            processed.index_buf = array_to_gl_buffer(group.indices)
+            processed.vertex_count = group.vertex_count
             self.vbos.append((group.material, processed))
             processed.build_vao(shader)
 
@@ -259,7 +627,7 @@ class WavefrontVBO(object):
             tex_id = self._tex_cache[mat.texture] if mat and mat.texture else 0
 
             if tex_id:
-                glBindTexture(GL_TEXTURE_2D, tex_id)
+                state.bind_texture(GL_TEXTURE_2D, tex_id)
                 shader.uniform_bool('u_material.hasDiffuse', True)
                 shader.uniform_texture('u_material.diffuseMap', 0)
             else:
@@ -286,61 +654,3 @@ class WavefrontVBO(object):
                 shader.uniform_float('u_material.shininess', 0)
 
             vbo.draw(shader, instances=instances)
-
-    def merge_groups(self, model):
-        by_mat = defaultdict(list)
-        for g in model.groups:
-            if g.faces:
-                by_mat[g.material].append(g)
-
-        groups = []
-        for mat, gs in six.iteritems(by_mat):
-            faces = []
-            for g in gs:
-                faces += g.faces
-            groups.append(Group(mat, faces))
-        return groups
-
-    def process_group(self, group, vertices, normals, textures):
-        sx, sy, sz = self.scale
-        max_texture = len(textures)
-        has_texture = bool(textures) and any(any(n is not None for n in f.texs) for f in group.faces)
-        has_normal = bool(normals) and any(any(n is not None for n in f.norms) for f in group.faces)
-        buffer = []
-        indices = []
-        offsets = {}
-
-        for f in group.faces:
-            verts = []
-            for v, n, t in zip(f.verts, f.norms, f.texs):
-                # Blender defines texture coordinates on faces even without textures.
-                if t is not None and t >= max_texture:
-                    t = None
-                if (v, n, t) in offsets:
-                    verts.append(offsets[v, n, t])
-                else:
-                    index = len(offsets)
-                    verts.append(index)
-                    x, y, z = vertices[v]
-                    item = [sx * x, sy * y, sz * z]
-                    if has_normal:
-                        item += [0, 0, 0] if n is None else list(normals[n])
-                    if has_texture:
-                        item += [0, 0] if t is None else list(textures[t])
-                    offsets[v, n, t] = index
-                    buffer += item
-
-            for a, b in zip(verts[1:], verts[2:]):
-                indices += [verts[0], a, b]
-
-        result = ModelVBO()
-        result.has_normal = has_normal
-        result.has_texture = has_texture
-        result.offset_type = GL_UNSIGNED_SHORT if len(offsets) < 65536 else GL_UNSIGNED_INT
-        result.data_buf = list_to_gl_buffer(buffer, 'f')
-        result.index_buf = list_to_gl_buffer(indices, {
-            GL_UNSIGNED_SHORT: 'H',
-            GL_UNSIGNED_INT: 'I',
-        }[result.offset_type])
-        result.vertex_count = len(indices)
-        return result
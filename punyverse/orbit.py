@@ -1,4 +1,168 @@
-from math import sin, cos, tan, atan, sqrt, radians, degrees
+from math import sin, cos, tan, atan, sqrt, radians, degrees, pi, copysign
+
+import numpy
+
+KEPLER_TOLERANCE = 1e-10
+KEPLER_MAX_ITERATIONS = 8
+EPHEMERIS_TOLERANCE = 0.001
+
+_MARKLEY_DENOMINATOR = pi ** 2 - 6
+
+
+def reduce_anomaly(mean_anomaly):
+    """Wraps an angle in radians into [-pi, pi)."""
+    return (mean_anomaly + pi) % (2 * pi) - pi
+
+
+def kepler_start(mean_anomaly, eccentricity):
+    """Markley's starting guess for the eccentric anomaly, for a mean anomaly in [-pi, pi).
+
+    Already accurate to within about 1e-3 radians even for eccentricities close to 1."""
+    m = abs(mean_anomaly)
+    e = eccentricity
+    alpha = (3 * pi ** 2 + 1.6 * pi * (pi - m) / (1 + e)) / _MARKLEY_DENOMINATOR
+    d = 3 * (1 - e) + alpha * e
+    q = 2 * alpha * d * (1 - e) - m * m
+    r = 3 * alpha * d * (d - 1 + e) * m + m ** 3
+    w = (abs(r) + sqrt(q ** 3 + r * r)) ** (2 / 3.0)
+    denominator = w * w + w * q + q * q
+    if not denominator:
+        return mean_anomaly
+    return copysign((2 * r * w / denominator + m) / d, mean_anomaly)
+
+
+def solve_kepler(mean_anomaly, eccentricity):
+    """Solves Kepler's equation with Halley's method from Markley's starter.
+
+    Returns the eccentric anomaly and the number of iterations taken, never more than KEPLER_MAX_ITERATIONS."""
+    mean_anomaly = reduce_anomaly(mean_anomaly)
+    anomaly = kepler_start(mean_anomaly, eccentricity)
+    for iterations in range(1, KEPLER_MAX_ITERATIONS + 1):
+        e_sin = eccentricity * sin(anomaly)
+        f = anomaly - e_sin - mean_anomaly
+        df = 1 - eccentricity * cos(anomaly)
+        delta = f / (df - 0.5 * f * e_sin / df)
+        anomaly -= delta
+        if abs(delta) <= KEPLER_TOLERANCE:
+            break
+    return anomaly, iterations
+
+
+def solve_kepler_array(mean_anomaly, eccentricity):
+    """Vectorized solve_kepler, iterating only on the elements that have yet to converge."""
+    mean_anomaly = numpy.remainder(mean_anomaly + pi, 2 * pi) - pi
+    m = numpy.abs(mean_anomaly)
+    e = eccentricity
+    alpha = (3 * pi ** 2 + 1.6 * pi * (pi - m) / (1 + e)) / _MARKLEY_DENOMINATOR
+    d = 3 * (1 - e) + alpha * e
+    q = 2 * alpha * d * (1 - e) - m * m
+    r = 3 * alpha * d * (d - 1 + e) * m + m ** 3
+    w = (numpy.abs(r) + numpy.sqrt(q ** 3 + r * r)) ** (2 / 3.0)
+    denominator = w * w + w * q + q * q
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        start = numpy.copysign((2 * r * w / denominator + m) / d, mean_anomaly)
+    anomaly = numpy.where(denominator != 0, start, mean_anomaly)
+
+    iterations = numpy.zeros(len(anomaly), dtype=numpy.int32)
+    active = numpy.arange(len(anomaly))
+    for _ in range(KEPLER_MAX_ITERATIONS):
+        if not len(active):
+            break
+        a, m, e = anomaly[active], mean_anomaly[active], eccentricity[active]
+        e_sin = e * numpy.sin(a)
+        f = a - e_sin - m
+        df = 1 - e * numpy.cos(a)
+        delta = f / (df - 0.5 * f * e_sin / df)
+        anomaly[active] = a - delta
+        iterations[active] += 1
+        active = active[numpy.abs(delta) > KEPLER_TOLERANCE]
+    return anomaly, iterations
+
+
+def orbit_axes(longitude, inclination, argument):
+    """Returns where the x and y axes of the orbital plane end up in world space, given angles in radians.
+
+    These are the first two columns of the longitude, inclination and argument rotations of KeplerOrbit.orbit,
+    with the y and z axes swapped the way Body expects. Works on arrays of angles too."""
+    sl, cl = numpy.sin(longitude), numpy.cos(longitude)
+    si, ci = numpy.sin(inclination), numpy.cos(inclination)
+    sa, ca = numpy.sin(argument), numpy.cos(argument)
+    column_x = numpy.stack([ca * ci * cl - sa * sl, -si * cl, -sa * ci * cl - ca * sl], axis=-1)
+    column_y = numpy.stack([ca * ci * sl + sa * cl, -si * sl, -sa * ci * sl + ca * cl], axis=-1)
+    return column_x, column_y
+
+
+class Ephemeris(object):
+    """Positions over one period of a KeplerOrbit, interpolated by mean anomaly with cubic Hermite splines.
+
+    The table starts at 64 samples and doubles until the interpolation error halfway between samples,
+    where it is largest, is within tolerance. Eccentric orbits thus automatically get finer tables.
+    Orbits so eccentric that even max_samples misses the tolerance are left inaccurate; see accurate."""
+
+    min_samples = 64
+    max_samples = 65536
+
+    def __init__(self, orbit, tolerance):
+        self.elements = orbit.elements
+        self.tolerance = tolerance
+
+        sma, eccentricity, inclination, longitude, argument = self.elements
+        self._sma = sma
+        self._semi_minor = sma * sqrt(1 - eccentricity ** 2)
+        self._eccentricity = eccentricity
+        self._column_x, self._column_y = orbit_axes(longitude, inclination, argument)
+
+        samples = self.min_samples
+        while True:
+            spacing = 2 * pi / samples
+            anomaly = numpy.arange(samples) * spacing
+            self.positions, derivatives = self._exact(anomaly)
+            # Derivatives are stored per sample, instead of per radian, as Hermite interpolation wants them.
+            self.derivatives = derivatives * spacing
+            self.samples = samples
+
+            error = numpy.abs(self.evaluate(anomaly + spacing / 2) - self._exact(anomaly + spacing / 2)[0]).max()
+            if error <= tolerance or samples >= self.max_samples:
+                break
+            samples *= 2
+        self.error = error
+
+    @property
+    def accurate(self):
+        return self.error <= self.tolerance
+
+    def _exact(self, mean_anomaly):
+        e = self._eccentricity
+        anomaly, iterations = solve_kepler_array(mean_anomaly, numpy.full(len(mean_anomaly), e))
+        sin_e, cos_e = numpy.sin(anomaly), numpy.cos(anomaly)
+        rate = 1 / (1 - e * cos_e)  # dE/dM
+        x, y = self._sma * (cos_e - e), self._semi_minor * sin_e
+        dx, dy = -self._sma * sin_e * rate, self._semi_minor * cos_e * rate
+        return (self._column_x * x[:, None] + self._column_y * y[:, None],
+                self._column_x * dx[:, None] + self._column_y * dy[:, None])
+
+    def evaluate(self, mean_anomaly):
+        """Interpolates positions at an array of mean anomalies in radians."""
+        return hermite(self.positions, self.derivatives, 0, self.samples, mean_anomaly)
+
+
+def hermite(positions, derivatives, offset, samples, mean_anomaly):
+    """Evaluates periodic cubic Hermite splines sampled uniformly in mean anomaly.
+
+    The samples of each spline start at offset in positions and derivatives. Where there are many splines,
+    offset, samples and mean_anomaly are arrays with one element per spline."""
+    u = numpy.remainder(mean_anomaly * (samples / (2 * pi)), samples)
+    i = numpy.floor(u).astype(numpy.intp)
+    t = (u - i)[:, None]
+    i = numpy.minimum(i, samples - 1)
+    j = numpy.where(i + 1 < samples, i + 1, 0)
+    i += offset
+    j += offset
+
+    t2 = t * t
+    t3 = t2 * t
+    return ((2 * t3 - 3 * t2 + 1) * positions[i] + (t3 - 2 * t2 + t) * derivatives[i] +
+            (3 * t2 - 2 * t3) * positions[j] + (t3 - t2) * derivatives[j])
 
 
 class KeplerOrbit(object):
@@ -11,6 +175,13 @@ class KeplerOrbit(object):
         self.__true_anomaly_factor = sqrt((1 + eccentricity)/(1 - eccentricity))
         self.__distance_factor = sma * (1 - eccentricity ** 2)
 
+        # Kepler solver statistics
+        self.solves = 0
+        self.iterations = 0
+        self.max_iterations = 0
+
+        self._ephemeris = None
+
     @property
     def inclination(self):
         return degrees(self._inclination)
@@ -66,12 +237,30 @@ class KeplerOrbit(object):
         self.__cos_argument = cos(self._argument)
 
     def eccentric_anomaly(self, mean_anomaly):
-        e1 = 0
-        e2 = mean_anomaly
-        while abs(e1 - e2) > 0.000001:
-            e1, e2 = e2, e2 - ((e2 - mean_anomaly - self.eccentricity * sin(e2)) /
-                               (1 - self.eccentricity * cos(e2)))
-        return e2
+        anomaly, iterations = solve_kepler(mean_anomaly, self.eccentricity)
+        self.solves += 1
+        self.iterations += iterations
+        self.max_iterations = max(self.max_iterations, iterations)
+        return anomaly
+
+    @property
+    def elements(self):
+        return self.sma, self.eccentricity, self._inclination, self._longitude, self._argument
+
+    def ephemeris(self, tolerance=None):
+        """Returns the position table of this orbit, rebuilding it if the elements or tolerance changed.
+
+        Without a tolerance, the current table is reused whatever its tolerance."""
+        ephemeris = self._ephemeris
+        if tolerance is None:
+            tolerance = EPHEMERIS_TOLERANCE if ephemeris is None else ephemeris.tolerance
+        if ephemeris is None or ephemeris.tolerance != tolerance or ephemeris.elements != self.elements:
+            self._ephemeris = ephemeris = Ephemeris(self, tolerance)
+        return ephemeris
+
+    @property
+    def average_iterations(self):
+        return float(self.iterations) / self.solves if self.solves else 0
 
     def true_anomaly(self, mean_anomaly):
         eccentric_anomaly = self.eccentric_anomaly(mean_anomaly)
@@ -94,3 +283,135 @@ class KeplerOrbit(object):
                -x * self.__sin_argument + y * self.__cos_argument)
 
         return x, y, z
+
+
+class OrbitEngine(object):
+    """Solves the orbits of every body at once.
+
+    Orbital elements are kept in structure-of-arrays form, one row per orbiting body, added in hierarchy
+    order so that parents always come before their satellites. Positions are relative to the topmost
+    body that does not orbit anything, with the axes swapped into world space the way Body expects.
+
+    With a tolerance, positions are looked up from the Ephemeris of every orbit instead of solving
+    Kepler's equation, except for orbits whose table can't get within tolerance, which are still solved
+    every tick. Call refresh after changing it."""
+
+    def __init__(self, tolerance=None):
+        self.tolerance = tolerance
+        self._orbits = []
+        self._speeds = []
+        self._parents = []
+        self._names = []
+        self._dirty = True
+        self.positions = numpy.zeros((0, 3))
+
+        # Kepler solver statistics, per orbit
+        self.solves = 0
+        self.iterations = numpy.zeros(0, dtype=numpy.int64)
+        self.max_iterations = numpy.zeros(0, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self._orbits)
+
+    def add(self, orbit, speed, parent=None, name=None):
+        """Adds a KeplerOrbit, whose parent is the row of the orbiting body it goes around, if any."""
+        self._orbits.append(orbit)
+        self._names.append(name)
+        self._speeds.append(speed)
+        self._parents.append(-1 if parent is None else parent)
+        self._dirty = True
+        return len(self._orbits) - 1
+
+    def refresh(self):
+        """Reloads the orbital elements, to be called after any KeplerOrbit changes."""
+        orbits = self._orbits
+        eccentricity = numpy.array([orbit.eccentricity for orbit in orbits], dtype=numpy.float64)
+        sma = numpy.array([orbit.sma for orbit in orbits], dtype=numpy.float64)
+        self._eccentricity = eccentricity
+        self._speed = numpy.array(self._speeds, dtype=numpy.float64)
+        self._true_anomaly_factor = numpy.sqrt((1 + eccentricity) / (1 - eccentricity))
+        self._distance_factor = sma * (1 - eccentricity ** 2)
+
+        self._column_x, self._column_y = orbit_axes(
+            numpy.array([orbit.longitude_radian for orbit in orbits]),
+            numpy.array([orbit.inclination_radian for orbit in orbits]),
+            numpy.array([orbit.argument_radian for orbit in orbits]))
+
+        tabled = numpy.zeros(len(orbits), dtype=bool)
+        if self.tolerance is not None:
+            ephemerides = [orbit.ephemeris(self.tolerance) for orbit in orbits]
+            tabled[:] = [ephemeris.accurate for ephemeris in ephemerides]
+        self._tabled = numpy.flatnonzero(tabled)
+        self._solved = numpy.flatnonzero(~tabled)
+
+        if len(self._tabled):
+            # All the accurate tables, end to end.
+            ephemerides = [ephemerides[row] for row in self._tabled]
+            self._samples = numpy.array([ephemeris.samples for ephemeris in ephemerides], dtype=numpy.intp)
+            self._offsets = numpy.concatenate([[0], numpy.cumsum(self._samples)[:-1]])
+            self._table_positions = numpy.concatenate([ephemeris.positions for ephemeris in ephemerides])
+            self._table_derivatives = numpy.concatenate([ephemeris.derivatives for ephemeris in ephemerides])
+
+        parents = numpy.array(self._parents, dtype=numpy.intp)
+        depth = numpy.zeros(len(parents), dtype=numpy.intp)
+        for row, parent in enumerate(self._parents):
+            if parent >= 0:
+                depth[row] = depth[parent] + 1
+        self._levels = []
+        for level in range(1, depth.max() + 1):
+            rows = numpy.flatnonzero(depth == level)
+            self._levels.append((rows, parents[rows]))
+
+        self.positions = numpy.zeros((len(orbits), 3))
+        self.solves = 0
+        self.iterations = numpy.zeros(len(orbits), dtype=numpy.int64)
+        self.max_iterations = numpy.zeros(len(orbits), dtype=numpy.int32)
+        self._dirty = False
+
+    def update(self, tick):
+        if not self._orbits:
+            return
+        if self._dirty:
+            self.refresh()
+
+        mean_anomaly = numpy.radians(tick * self._speed % 360)
+        positions = self.positions
+        tabled = self._tabled
+        if len(tabled):
+            positions[tabled] = hermite(self._table_positions, self._table_derivatives,
+                                        self._offsets, self._samples, mean_anomaly[tabled])
+
+        solved = self._solved
+        if len(solved):
+            eccentricity = self._eccentricity[solved]
+            eccentric_anomaly, iterations = solve_kepler_array(mean_anomaly[solved], eccentricity)
+            self.solves += 1
+            self.iterations[solved] += iterations
+            self.max_iterations[solved] = numpy.maximum(self.max_iterations[solved], iterations)
+
+            phi = 2 * numpy.arctan(self._true_anomaly_factor[solved] * numpy.tan(eccentric_anomaly / 2))
+            r = self._distance_factor[solved] / (1 + eccentricity * numpy.cos(phi))
+
+            positions[solved] = (self._column_x[solved] * (r * numpy.cos(phi))[:, None] +
+                                 self._column_y[solved] * (r * numpy.sin(phi))[:, None])
+
+        for rows, parents in self._levels:
+            positions[rows] += positions[parents]
+
+    def position(self, row):
+        x, y, z = self.positions[row]
+        return float(x), float(y), float(z)
+
+    def iteration_stats(self):
+        """Returns the average and maximum Kepler solver iterations, and the name of the worst orbit."""
+        if not self.solves:
+            return 0, 0, None
+        worst = int(numpy.argmax(self.max_iterations))
+        average = float(self.iterations.sum()) / (self.solves * len(self._solved))
+        return average, int(self.max_iterations[worst]), self._names[worst]
+
+    def ephemeris_stats(self):
+        """Returns how many orbits are looked up from tables, out of all of them, and their total samples."""
+        if self._dirty:
+            return 0, len(self._orbits), 0
+        return len(self._tabled), len(self._orbits), int(self._samples.sum()) if len(self._tabled) else 0
@@ -0,0 +1,249 @@
+from collections import OrderedDict
+from itertools import chain
+from timeit import default_timer
+
+import numpy
+from pyglet.gl import *
+from six.moves import range
+
+from punyverse.glgeom import VAO, empty_gl_buffer
+from punyverse.glstate import state
+
+# The passes of a frame, in the order they are drawn.
+BACKGROUND, OPAQUE, TRANSLUCENT = range(3)
+
+
+def insertion_sort(items, keys):
+    """Sorts items in place by the parallel list keys, smallest first.
+
+    This takes O(n + inversions) time, so it is almost linear when the order barely changes from the last call.
+    Returns the number of elements shifted."""
+    shifts = 0
+    for i in range(1, len(keys)):
+        key = keys[i]
+        if keys[i - 1] <= key:
+            continue
+        item = items[i]
+        j = i - 1
+        while j >= 0 and keys[j] > key:
+            keys[j + 1] = keys[j]
+            items[j + 1] = items[j]
+            j -= 1
+        shifts += i - 1 - j
+        keys[j + 1] = key
+        items[j + 1] = item
+    return shifts
+
+
+class RenderOrder(object):
+    """The order to run the items of a RenderQueue in, kept from one frame to the next.
+
+    Background items come first, as they were submitted. Opaque ones are bucketed by program, then texture, to cut
+    down changes of state, and drawn front to back within a bucket to cut overdraw. The buckets are only sorted
+    again when one comes or goes. Translucent ones go back to front so they blend correctly, and only items at the
+    same depth are grouped. Every frame submits mostly the same draw functions at slowly changing depths, so the
+    opaque and translucent items start out in last frame's order and are sorted incrementally."""
+
+    def __init__(self):
+        self.background = []
+        self.opaque = OrderedDict()  # (program, texture) -> items nearest first, in the order the buckets run
+        self.translucent = []  # Farthest first
+        self.shifts = 0  # Items moved by the last sort
+        self.sort_time = 0
+
+    def __len__(self):
+        return len(self.background) + sum(map(len, self.opaque.values())) + len(self.translucent)
+
+    def __iter__(self):
+        return chain(self.background, chain.from_iterable(self.opaque.values()), self.translucent)
+
+    @staticmethod
+    def _carry(previous, current):
+        # This frame's items, in the order their draw functions had last frame, with new ones at the end.
+        items = [current.pop(item.function) for item in previous if item.function in current]
+        items.extend(current.values())
+        return items
+
+    def update(self, items):
+        """Replaces the order with that of items, this frame's, in the order they were submitted."""
+        start = default_timer()
+        background = []
+        opaque = {}
+        translucent = OrderedDict()
+        for item in items:
+            if item.phase == BACKGROUND:
+                background.append(item)
+                continue
+            if item.phase == OPAQUE:
+                bucket = opaque.setdefault((item.program, item.texture), OrderedDict())
+            else:
+                bucket = translucent
+            key = item.function
+            if key in bucket:
+                key = key, len(bucket)  # Submitted twice, so there's nothing to match it with
+            bucket[key] = item
+
+        self.background = background
+        if set(opaque) != set(self.opaque):
+            previous = self.opaque
+            self.opaque = OrderedDict((key, previous.get(key, [])) for key in sorted(opaque))
+
+        shifts = 0
+        for key in self.opaque:
+            self.opaque[key] = bucket = self._carry(self.opaque[key], opaque[key])
+            shifts += insertion_sort(bucket, [item.depth for item in bucket])
+        self.translucent = self._carry(self.translucent, translucent)
+        shifts += insertion_sort(self.translucent,
+                                 [(-item.depth, item.program, item.texture) for item in self.translucent])
+        self.shifts = shifts
+        self.sort_time = default_timer() - start
+
+    def __str__(self):
+        return '%d background, %d opaque in %d buckets, %d translucent' % (
+            len(self.background), sum(map(len, self.opaque.values())), len(self.opaque), len(self.translucent))
+
+
+class QueueStats(object):
+    """The changes of program, texture and blending or culling state needed to draw a sequence of items."""
+    __slots__ = ('programs', 'textures', 'states')
+
+    def __init__(self, items=()):
+        self.programs = self.textures = self.states = 0
+        program = texture = blend = cull = None
+        for item in items:
+            if item.program != program:
+                self.programs += 1
+                program = item.program
+            if item.texture and item.texture != texture:
+                self.textures += 1
+                texture = item.texture
+            if item.blend != blend:
+                self.states += 1
+                blend = item.blend
+            if item.cull != cull:
+                self.states += 1
+                cull = item.cull
+
+
+class RenderItem(object):
+    __slots__ = ('phase', 'program', 'texture', 'depth', 'blend', 'cull', 'function', 'args')
+
+    def __init__(self, phase, program, texture, depth, cull, function, args):
+        self.phase = phase
+        self.program = program
+        self.texture = texture
+        self.depth = depth
+        self.blend = phase == TRANSLUCENT
+        self.cull = cull
+        self.function = function
+        self.args = args
+
+
+class RenderQueue(object):
+    """Draw calls submitted over a frame, and run in the order kept by a RenderOrder to cut down changes of state.
+
+    The queue enables blending for the translucent pass and culling for items that ask for it, so draw functions
+    leave both alone."""
+
+    def __init__(self):
+        self.items = []
+        self.order = RenderOrder()
+        self.before = QueueStats()  # Had the items run as they were submitted
+        self.after = QueueStats()
+
+    def __len__(self):
+        return len(self.items)
+
+    def submit(self, phase, program, texture, depth, function, args=(), cull=True):
+        """Queues function(*args), which draws with program and mostly texture, depth away from the camera.
+
+        function is how the item is told apart from the others between frames, so it should be a draw method
+        of the entity submitting it."""
+        self.items.append(RenderItem(phase, program, texture, depth, cull, function, args))
+
+    def execute(self):
+        self.before = QueueStats(self.items)
+        self.order.update(self.items)
+        self.after = QueueStats(self.order)
+
+        blend = cull = None
+        for item in self.order:
+            if item.blend != blend:
+                (state.enable if item.blend else state.disable)(GL_BLEND)
+                blend = item.blend
+            if item.cull != cull:
+                (state.enable if item.cull else state.disable)(GL_CULL_FACE)
+                cull = item.cull
+            item.function(*item.args)
+        del self.items[:]
+
+        state.disable(GL_BLEND)
+        state.enable(GL_CULL_FACE)
+
+    def __str__(self):
+        before, after = self.before, self.after
+        return '%d -> %d programs, %d -> %d textures, %d -> %d states' % (
+            before.programs, after.programs, before.textures, after.textures, before.states, after.states)
+
+
+class PointSprites(object):
+    """Bodies too small to draw on their own, collected over a frame and drawn as points in a single call."""
+    type = GL_FLOAT
+    stride = 7 * 4
+    position_offset = 0
+    position_size = 3
+    color_offset = position_size * 4
+    color_size = 3
+    size_offset = color_offset + color_size * 4
+    size_size = 1
+
+    def __init__(self, world, capacity=32):
+        self.world = world
+        self.data = numpy.zeros((capacity, 7), dtype=numpy.float32)
+        self.count = 0
+        self.vbo = empty_gl_buffer(self.data.nbytes)
+        self._resized = False
+
+        shader = world.activate_shader('sprite')
+        self.vao = VAO()
+        with self.vao:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            shader.vertex_attribute('a_position', self.position_size, self.type, GL_FALSE,
+                                    self.stride, self.position_offset)
+            shader.vertex_attribute('a_color', self.color_size, self.type, GL_FALSE,
+                                    self.stride, self.color_offset)
+            shader.vertex_attribute('a_size', self.size_size, self.type, GL_FALSE,
+                                    self.stride, self.size_offset)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, location, color, size):
+        if self.count == len(self.data):
+            self.data = numpy.concatenate([self.data, numpy.zeros_like(self.data)])
+            self._resized = True
+        self.data[self.count, 0:3] = location
+        self.data[self.count, 3:6] = color
+        self.data[self.count, 6] = size
+        self.count += 1
+
+    def draw(self):
+        """Draws and forgets every point added since the last call."""
+        if not self.count:
+            return
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if self._resized:
+            glBufferData(GL_ARRAY_BUFFER, self.data.nbytes, self.data.ctypes.data, GL_DYNAMIC_DRAW)
+            self._resized = False
+        else:
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.count * self.stride, self.data.ctypes.data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.world.activate_shader('sprite')
+        state.enable(GL_PROGRAM_POINT_SIZE)
+        with self.vao:
+            glDrawArrays(GL_POINTS, 0, self.count)
+        state.disable(GL_PROGRAM_POINT_SIZE)
+        self.count = 0
@@ -1,14 +1,20 @@
 from __future__ import print_function
 
 import os
+import re
 import sys
 from ctypes import pointer, byref, create_string_buffer, POINTER, cast
 
+import numpy
 from pyglet.gl import *
 # noinspection PyUnresolvedReferences
 from six.moves import range
 
+from punyverse.glgeom import empty_gl_buffer
+from punyverse.glstate import state
+
 SHADERS_DIR = os.path.join(os.path.dirname(__file__), 'shaders')
+INCLUDE_RE = re.compile(br'^#include\s+"([^"]+)"[ \t]*$', re.M)
 
 
 class CompileError(ValueError):
@@ -30,8 +36,10 @@ class glShader(object):
 class Program(object):
     @classmethod
     def load_file(cls, file):
+        """Reads a shader, replacing every #include "name" line with the contents of that file."""
         with open(os.path.join(SHADERS_DIR, file), 'rb') as f:
-            return f.read()
+            source = f.read()
+        return INCLUDE_RE.sub(lambda match: cls.load_file(match.group(1).decode('utf-8')), source)
 
     @classmethod
     def compile_shader(cls, shader, source):
@@ -78,6 +86,19 @@ class Program(object):
         self.program = program
         self.attributes = self._variable_locations(GL_ACTIVE_ATTRIBUTES, glGetActiveAttrib, glGetAttribLocation)
         self.uniforms = self._variable_locations(GL_ACTIVE_UNIFORMS, glGetActiveUniform, glGetUniformLocation)
+        self._values = {}  # Last value set, by uniform location
+
+        index = glGetUniformBlockIndex(program, create_string_buffer(FrameBlock.name))
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(program, index, FrameBlock.binding)
+
+    def _changed(self, location, value):
+        if self._values.get(location) == value:
+            state.elided += 1
+            return False
+        self._values[location] = value
+        state.issued += 1
+        return True
 
     def vertex_attribute(self, name, size, type, normalized, stride, offset, divisor=None):
         location = self.attributes[name]
@@ -93,25 +114,41 @@ class Program(object):
         glVertexAttrib3f(self.attributes[name], a, b, c)
 
     def uniform_mat4(self, name, matrix):
-        glUniformMatrix4fv(self.uniforms[name], 1, GL_FALSE, matrix)
+        location = self.uniforms[name]
+        # Matrices are updated in place, so keep a copy to compare against.
+        if self._changed(location, matrix.matrix):
+            self._values[location] = matrix.matrix[:]
+            glUniformMatrix4fv(location, 1, GL_FALSE, matrix)
 
     def uniform_texture(self, name, index):
-        glUniform1i(self.uniforms[name], index)
+        location = self.uniforms[name]
+        if self._changed(location, index):
+            glUniform1i(location, index)
 
     def uniform_float(self, name, value):
-        glUniform1f(self.uniforms[name], value)
+        location = self.uniforms[name]
+        if self._changed(location, value):
+            glUniform1f(location, value)
 
     def uniform_bool(self, name, value):
-        glUniform1i(self.uniforms[name], bool(value))
+        location = self.uniforms[name]
+        if self._changed(location, bool(value)):
+            glUniform1i(location, bool(value))
 
     def uniform_vec2(self, name, a, b):
-        glUniform2f(self.uniforms[name], a, b)
+        location = self.uniforms[name]
+        if self._changed(location, (a, b)):
+            glUniform2f(location, a, b)
 
     def uniform_vec3(self, name, a, b, c):
-        glUniform3f(self.uniforms[name], a, b, c)
+        location = self.uniforms[name]
+        if self._changed(location, (a, b, c)):
+            glUniform3f(location, a, b, c)
 
     def uniform_vec4(self, name, a, b, c, d):
-        glUniform4f(self.uniforms[name], a, b, c, d)
+        location = self.uniforms[name]
+        if self._changed(location, (a, b, c, d)):
+            glUniform4f(location, a, b, c, d)
 
     def _variable_locations(self, count_type, get_func, loc_func):
         variables = {}
@@ -125,3 +162,46 @@ class Program(object):
             get_func(self.program, index, 256, None, byref(size), byref(type), buffer)
             variables[buffer.value.decode('ascii')] = loc_func(self.program, buffer)
         return variables
+
+
+class FrameBlock(object):
+    """The Frame uniform block in frame.glsl: the camera and the sun, shared by every program.
+
+    This is uploaded in one call per frame, instead of setting the same matrices on each program that draws.
+    Offsets are in floats, following the std140 layout."""
+    name = b'Frame'
+    binding = 0
+    size = 68
+    view_offset = 0
+    proj_offset = 16
+    vp_offset = 32
+    camera_offset = 48
+    ambient_offset = 52
+    diffuse_offset = 56
+    specular_offset = 60
+    position_offset = 64
+    intensity_offset = 67
+
+    def __init__(self):
+        self.data = numpy.zeros(self.size, dtype=numpy.float32)
+        self.ubo = empty_gl_buffer(self.data.nbytes)
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.binding, self.ubo)
+
+    def sun(self, ambient, diffuse, specular, position, intensity):
+        data = self.data
+        data[self.ambient_offset:self.ambient_offset + 3] = ambient
+        data[self.diffuse_offset:self.diffuse_offset + 3] = diffuse
+        data[self.specular_offset:self.specular_offset + 3] = specular
+        data[self.position_offset:self.position_offset + 3] = position
+        data[self.intensity_offset] = intensity
+
+    def upload(self, view, projection, vp, camera):
+        data = self.data
+        data[self.view_offset:self.view_offset + 16] = view.matrix
+        data[self.proj_offset:self.proj_offset + 16] = projection.matrix
+        data[self.vp_offset:self.vp_offset + 16] = vp.matrix
+        data[self.camera_offset:self.camera_offset + 3] = camera
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data.ctypes.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
@@ -0,0 +1,39 @@
+#version 330 core
+
+in vec3 a_position;
+in vec3 a_normal;
+in vec2 a_uv;
+in vec3 a_translate;
+in vec3 a_rotation;
+
+out vec2 v_uv;
+out vec3 v_normal;
+out vec3 v_position;
+out vec3 v_camDirection;
+
+#include "frame.glsl"
+
+uniform mat4 u_modelMatrix;
+
+// Same as Matrix4f.from_angles, with pitch, yaw and roll in degrees.
+mat4 from_angles(vec3 location, vec3 rotation) {
+    vec3 s = sin(radians(rotation));
+    vec3 c = cos(radians(rotation));
+    return mat4(
+        c.y * c.z, s.x * s.y * c.z + c.x * s.z, s.x * s.z - c.x * s.y * c.z, 0,
+        -c.y * s.z, c.x * c.z - s.x * s.y * s.z, c.x * s.y * s.z + s.x * c.z, 0,
+        s.y, -s.x * c.y, c.x * c.y, 0,
+        location, 1
+    );
+}
+
+void main() {
+    mat4 matrix = from_angles(a_translate, a_rotation);
+    mat4 modelMatrix = u_modelMatrix * matrix;
+
+    gl_Position = u_vpMatrix * modelMatrix * vec4(a_position, 1);
+    v_normal = normalize(vec3(modelMatrix * vec4(a_normal, 0)));
+    v_uv = a_uv;
+    v_position = (modelMatrix * vec4(a_position, 1)).xyz;
+    v_camDirection = (u_viewMatrix * modelMatrix * vec4(a_position, 1)).xyz;
+}
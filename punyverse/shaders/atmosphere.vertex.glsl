@@ -5,9 +5,13 @@ in float a_u;
 
 out float v_u;
 
-uniform mat4 u_mvpMatrix;
+#include "frame.glsl"
+
+uniform mat4 u_modelMatrix;
 
 void main() {
-    gl_Position = u_mvpMatrix * vec4(a_position, 0, 1);
+    // Always faces the camera: only the centre goes through the model and view matrices.
+    vec4 centre = u_viewMatrix * u_modelMatrix * vec4(0, 0, 0, 1);
+    gl_Position = u_projMatrix * (centre + vec4(a_position, 0, 0));
     v_u = a_u;
 }
@@ -0,0 +1,10 @@
+#version 330 core
+
+out vec4 o_fragColor;
+uniform vec3 u_color;
+
+void main() {
+    if (length(gl_PointCoord - vec2(0.5)) > 0.5)
+        discard;
+    o_fragColor = vec4(u_color, 1);
+}
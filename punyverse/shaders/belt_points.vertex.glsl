@@ -0,0 +1,18 @@
+#version 330 core
+
+in vec4 a_elements;
+in vec2 a_angles;
+in float a_scale;
+
+#include "frame.glsl"
+#include "orbit.glsl"
+
+uniform mat4 u_modelMatrix;
+uniform float u_size;
+
+void main() {
+    vec4 position = u_modelMatrix * vec4(orbit_position(), 1);
+    gl_Position = u_vpMatrix * position;
+    float distance = length((u_viewMatrix * position).xyz);
+    gl_PointSize = max(u_size * a_scale / distance, 1);
+}
@@ -7,8 +7,9 @@ out vec2 v_uv;
 out vec3 v_normal;
 out vec3 v_position;
 
+#include "frame.glsl"
+
 uniform float u_radius;
-uniform mat4 u_mvpMatrix;
 uniform mat4 u_modelMatrix;
 
 void main() {
@@ -16,5 +17,5 @@ void main() {
     v_uv = a_uv;
     v_normal = (u_modelMatrix * vec4(a_normal, 0)).xyz;
     v_position = (u_modelMatrix * vec4(position, 1)).xyz;
-    gl_Position = u_mvpMatrix * vec4(position, 1);
+    gl_Position = u_vpMatrix * u_modelMatrix * vec4(position, 1);
 }
@@ -0,0 +1,17 @@
+// Shared by every program, and uploaded once per frame by FrameBlock in shader.py.
+
+struct Sun {
+    vec3 ambient;
+    vec3 diffuse;
+    vec3 specular;
+    vec3 position;
+    float intensity;
+};
+
+layout(std140) uniform Frame {
+    mat4 u_viewMatrix;
+    mat4 u_projMatrix;
+    mat4 u_vpMatrix;
+    vec3 u_camera;
+    Sun u_sun;
+};
@@ -0,0 +1,52 @@
+#version 330 core
+
+in vec3 v_position;
+
+out vec4 o_fragColor;
+
+#include "frame.glsl"
+
+uniform mat4 u_modelMatrix;
+uniform float u_radius;
+uniform float u_pixels;
+uniform float u_ambient;
+uniform bool u_emissive;
+uniform sampler2D u_albedo;
+uniform bool u_hasClouds;
+uniform sampler2D u_clouds;
+
+void main() {
+    // Intersect the view ray with the sphere, in view space.
+    mat4 mvMatrix = u_viewMatrix * u_modelMatrix;
+    vec3 centre = (mvMatrix * vec4(0, 0, 0, 1)).xyz;
+    vec3 ray = normalize(v_position);
+    float b = dot(ray, centre);
+    float h = b * b - dot(centre, centre) + u_radius * u_radius;
+    if (h < 0)
+        discard;
+    vec3 position = ray * (b - sqrt(h));
+    vec3 normal = (position - centre) / u_radius;
+
+    // The model matrix is a pure rotation, so its transpose takes the normal back to the sphere's own frame,
+    // where the texture coordinates are laid out the same way as in TangentSphere.
+    vec3 local = transpose(mat3(mvMatrix)) * normal;
+    vec2 uv = vec2(atan(local.y, local.x) / 6.28318530718, 1 - acos(clamp(local.z, -1, 1)) / 3.14159265359);
+
+    // Pick the mip level explicitly: the derivatives blow up across the seam where atan wraps around.
+    float lod = log2(textureSize(u_albedo, 0).x / (6.28318530718 * u_pixels));
+    vec3 albedo = textureLod(u_albedo, uv, max(lod, 0)).rgb;
+
+    if (u_emissive) {
+        o_fragColor = vec4(albedo, 1);
+    } else {
+        vec3 sun = (u_viewMatrix * vec4(u_sun.position, 1)).xyz;
+        float incident = dot(normal, normalize(sun - position));
+        vec3 color = albedo * (u_ambient + max(incident, 0));
+        if (u_hasClouds) {
+            float cloud = u_ambient + clamp(incident + 0.2, 0, 1);
+            float cloudLod = log2(textureSize(u_clouds, 0).x / (6.28318530718 * u_pixels));
+            color = mix(color, vec3(cloud), textureLod(u_clouds, uv, max(cloudLod, 0)).r);
+        }
+        o_fragColor = vec4(color, 1);
+    }
+}
@@ -0,0 +1,23 @@
+#version 330 core
+
+in vec2 a_position;
+
+out vec3 v_position;
+
+#include "frame.glsl"
+
+uniform mat4 u_modelMatrix;
+uniform float u_radius;
+
+void main() {
+    // Face the camera with a square just large enough to hold the sphere's silhouette in perspective.
+    vec3 centre = (u_viewMatrix * u_modelMatrix * vec4(0, 0, 0, 1)).xyz;
+    float distance = length(centre);
+    vec3 forward = centre / distance;
+    vec3 right = normalize(cross(forward, abs(forward.y) < 0.99 ? vec3(0, 1, 0) : vec3(1, 0, 0)));
+    vec3 up = cross(right, forward);
+    float size = u_radius / sqrt(max(1 - u_radius * u_radius / (distance * distance), 0.01));
+
+    v_position = centre + (a_position.x * right + a_position.y * up) * size;
+    gl_Position = u_projMatrix * vec4(v_position, 1);
+}
@@ -16,15 +16,8 @@ struct Material {
     float shininess;
 };
 
-struct Sun {
-    vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-    vec3 position;
-    float intensity;
-};
+#include "frame.glsl"
 
-uniform Sun u_sun;
 uniform Material u_material;
 
 void main() {
@@ -9,14 +9,14 @@ out vec3 v_normal;
 out vec3 v_position;
 out vec3 v_camDirection;
 
-uniform mat4 u_mvpMatrix;
-uniform mat4 u_mvMatrix;
+#include "frame.glsl"
+
 uniform mat4 u_modelMatrix;
 
 void main() {
-    gl_Position = u_mvpMatrix * vec4(a_position, 1);
+    gl_Position = u_vpMatrix * u_modelMatrix * vec4(a_position, 1);
     v_normal = normalize(vec3(u_modelMatrix * vec4(a_normal, 0)));
     v_uv = a_uv;
     v_position = (u_modelMatrix * vec4(a_position, 1)).xyz;
-    v_camDirection = (u_mvMatrix * vec4(a_position, 1)).xyz;
+    v_camDirection = (u_viewMatrix * u_modelMatrix * vec4(a_position, 1)).xyz;
 }
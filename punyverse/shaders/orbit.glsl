@@ -0,0 +1,21 @@
+uniform float u_tick;
+uniform float u_meanMotion;
+uniform float u_radius;
+
+// Position on the orbit described by a_elements and a_angles at u_tick, in the plane of the belt.
+vec3 orbit_position() {
+    float sma = a_elements.x;
+    float e = a_elements.y;
+    float mean = mod(a_elements.z + u_meanMotion * pow(u_radius / sma, 1.5) * u_tick, 6.28318530718);
+
+    float E = mean + e * sin(mean);
+    for (int i = 0; i < 3; ++i)
+        E -= (E - e * sin(E) - mean) / (1 - e * cos(E));
+
+    vec2 plane = sma * vec2(cos(E) - e, sqrt(1 - e * e) * sin(E));
+    float cw = cos(a_angles.y), sw = sin(a_angles.y);
+    plane = vec2(plane.x * cw - plane.y * sw, plane.x * sw + plane.y * cw);
+    vec3 tilted = vec3(plane.x, plane.y * cos(a_elements.w), plane.y * sin(a_elements.w));
+    float cn = cos(a_angles.x), sn = sin(a_angles.x);
+    return vec3(tilted.x * cn - tilted.y * sn, tilted.z, tilted.x * sn + tilted.y * cn);
+}
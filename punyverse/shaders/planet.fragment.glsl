@@ -23,16 +23,11 @@ struct Surface {
     float shininess;
 };
 
-struct Sun {
-    vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-    vec3 position;
-    float intensity;
-};
+#include "frame.glsl"
 
-uniform Sun u_sun;
 uniform Surface u_planet;
+uniform bool u_hasClouds;
+uniform sampler2D u_clouds;
 
 void main() {
     vec3 normal = u_planet.hasNormal ? normalize(v_TBN * texture(u_planet.normalMap, v_uv).rgb * 2 - 1) : v_normal;
@@ -51,5 +46,11 @@ void main() {
     emission *= u_planet.emission * (1 - min(diffuseIntensity * 2, 1));
     specular *= u_planet.specular * u_sun.specular * max(shininess, 0) * diffuseIntensity;
 
-    o_fragColor = vec4((ambient + diffuse + emission + specular) * u_sun.intensity, 1);
+    vec3 color = (ambient + diffuse + emission + specular) * u_sun.intensity;
+    if (u_hasClouds) {
+        // Lit the same way as the separate cloud layer, drawn when the planet is large enough for it to matter.
+        vec3 cloud = u_sun.ambient + u_sun.diffuse * clamp(dot(v_normal, incident) + 0.2, 0.0, 1.0);
+        color = mix(color, cloud, texture(u_clouds, v_uv).r);
+    }
+    o_fragColor = vec4(color, 1);
 }
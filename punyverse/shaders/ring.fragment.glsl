@@ -5,15 +5,16 @@ in float v_u;
 
 out vec4 o_fragColor;
 
-uniform vec3 u_sun;
+#include "frame.glsl"
+
 uniform vec3 u_planet;
 uniform float u_planetRadius;
 uniform float u_ambient;
 uniform sampler1D u_texture;
 
 void main() {
-    vec3 incident = v_position - u_sun;
-    vec3 plane_normal = u_planet - u_sun;
+    vec3 incident = v_position - u_sun.position;
+    vec3 plane_normal = u_planet - u_sun.position;
     vec3 plane_intersect = dot(plane_normal, plane_normal) / dot(incident, plane_normal) * incident;
     o_fragColor = texture(u_texture, v_u);
     if (length(plane_intersect) < length(incident) &&
@@ -6,11 +6,13 @@ in float a_u;
 out vec3 v_position;
 out float v_u;
 
-uniform mat4 u_mvpMatrix;
+#include "frame.glsl"
+
 uniform mat4 u_modelMatrix;
 
 void main() {
-    gl_Position = u_mvpMatrix * vec4(a_position, 0, 1);
-    v_position = (u_modelMatrix * vec4(a_position, 0, 1)).xyz;
+    vec4 position = u_modelMatrix * vec4(a_position, 0, 1);
+    gl_Position = u_vpMatrix * position;
+    v_position = position.xyz;
     v_u = a_u;
 }
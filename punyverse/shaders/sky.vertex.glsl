@@ -2,9 +2,13 @@
 
 in vec3 a_direction;
 out vec3 v_direction;
-uniform mat4 u_mvpMatrix;
+
+#include "frame.glsl"
+
+uniform mat4 u_modelMatrix;
 
 void main() {
-    gl_Position = (u_mvpMatrix * vec4(a_direction, 1)).xyww;
+    // Only the camera's rotation applies, since the sky is infinitely far away.
+    gl_Position = (u_projMatrix * mat4(mat3(u_viewMatrix)) * u_modelMatrix * vec4(a_direction, 1)).xyww;
     v_direction = a_direction;
 }
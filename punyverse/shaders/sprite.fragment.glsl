@@ -0,0 +1,11 @@
+#version 330 core
+
+in vec3 v_color;
+
+out vec4 o_fragColor;
+
+void main() {
+    if (length(gl_PointCoord - vec2(0.5)) > 0.5)
+        discard;
+    o_fragColor = vec4(v_color, 1);
+}
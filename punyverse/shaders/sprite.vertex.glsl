@@ -0,0 +1,15 @@
+#version 330 core
+
+in vec3 a_position;
+in vec3 a_color;
+in float a_size;
+
+out vec3 v_color;
+
+#include "frame.glsl"
+
+void main() {
+    gl_Position = u_vpMatrix * vec4(a_position, 1);
+    gl_PointSize = a_size;
+    v_color = a_color;
+}
@@ -5,10 +5,12 @@ in vec2 a_uv;
 
 out vec2 v_uv;
 
+#include "frame.glsl"
+
 uniform float u_radius;
-uniform mat4 u_mvpMatrix;
+uniform mat4 u_modelMatrix;
 
 void main() {
-    gl_Position = u_mvpMatrix * vec4(u_radius * a_normal, 1);
+    gl_Position = u_vpMatrix * u_modelMatrix * vec4(u_radius * a_normal, 1);
     v_uv = a_uv;
 }
@@ -0,0 +1,160 @@
+from __future__ import division
+
+import threading
+from collections import deque
+from timeit import default_timer
+
+import numpy
+
+# Steps per second of the simulation thread, i.e. with --simulation-rate.
+# When 0, the world is simulated on the render thread, once per frame.
+rate = 0
+
+# How many steps the simulation may fall behind before it gives up catching up.
+MAX_LAG = 10
+
+
+class Snapshot(object):
+    """The simulated state of the world at the end of one step."""
+    __slots__ = ('time', 'tick', 'location', 'rotation', 'asteroid_alive', 'asteroid_model', 'asteroid_age',
+                 'asteroid_location', 'asteroid_rotation')
+
+    def __init__(self, count, capacity):
+        self.time = 0
+        self.tick = 0
+        self.location = numpy.zeros((count, 3))
+        self.rotation = numpy.zeros((count, 3))
+        self.asteroid_alive = numpy.zeros(capacity, dtype=bool)
+        self.asteroid_model = numpy.zeros(capacity, dtype=numpy.intp)
+        self.asteroid_age = numpy.zeros(capacity, dtype=numpy.intp)
+        self.asteroid_location = numpy.zeros((capacity, 3))
+        self.asteroid_rotation = numpy.zeros((capacity, 3))
+
+
+class Simulation(object):
+    """Advances the orbits, rotations and asteroids of a world at a fixed rate on a worker thread.
+
+    Every step is published as a Snapshot. The render thread interpolates between the last two into the
+    EntityStore and the AsteroidSystem, so motion stays smooth whatever the frame rate, and the frame never
+    waits on a burst of catching up under heavy time warp. The worker owns its own copies of the locations
+    and rotations, as well as the orbit engine and the asteroid arrays, so the two threads only meet to swap
+    snapshots."""
+
+    def __init__(self, world, rate):
+        self.world = world
+        self.step = 1 / rate
+        self.running = True
+        self.tick = world.tick
+        self.steps = 0
+        self.dropped = 0  # Steps skipped because the simulation fell too far behind
+        self._accumulate = 0
+        self._spawns = deque()
+
+        store = world.entities
+        count = len(store)
+        self._location = store.location[:count].copy()
+        self._rotation = store.rotation[:count].copy()
+
+        self._lock = threading.Lock()
+        self._snapshots = [Snapshot(count, world.asteroids.capacity) for i in range(3)]
+        for snapshot in self._snapshots:
+            self._fill(snapshot, default_timer())
+        self._previous, self._current, self._back = self._snapshots
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='simulation')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def spawn_asteroid(self, location, direction):
+        # The asteroid arrays belong to the worker, so it does the spawning.
+        self._spawns.append((location, direction))
+
+    def _fill(self, snapshot, time):
+        asteroids = self.world.asteroids
+        snapshot.time = time
+        snapshot.tick = self.tick
+        snapshot.location[:] = self._location
+        snapshot.rotation[:] = self._rotation
+        snapshot.asteroid_alive[:] = asteroids.alive
+        snapshot.asteroid_model[:] = asteroids.model
+        snapshot.asteroid_age[:] = asteroids.age
+        snapshot.asteroid_location[:] = asteroids.asteroid_location
+        snapshot.asteroid_rotation[:] = asteroids.asteroid_rotation
+
+    def _advance(self):
+        world = self.world
+        while self._spawns:
+            world.asteroids.spawn(*self._spawns.popleft())
+
+        if not self.running:
+            return
+
+        delta = world.tick_length * self.step
+        update = int(delta + self._accumulate + 0.5)
+        if update:
+            self._accumulate = 0
+            self.tick += update
+            world.orbits.update(self.tick)
+            world.entities.advance(self.tick, world.orbits, self._location, self._rotation)
+            c = world.cam
+            world.asteroids.update((c.x, c.y, c.z))
+        else:
+            self._accumulate += delta
+
+    def _run(self):
+        deadline = default_timer()
+        while not self._stop.is_set():
+            self._advance()
+            self.steps += 1
+
+            snapshot = self._back
+            self._fill(snapshot, default_timer())
+            with self._lock:
+                self._back = self._previous
+                self._previous, self._current = self._current, snapshot
+
+            deadline += self.step
+            delay = deadline - default_timer()
+            if delay > 0:
+                self._stop.wait(delay)
+            elif delay < -MAX_LAG * self.step:
+                lag = int(-delay / self.step)
+                self.dropped += lag
+                deadline += lag * self.step
+
+    def interpolate(self):
+        """Writes the state between the last two snapshots, one step behind now, into the world."""
+        world = self.world
+        store = world.entities
+        now = default_timer()
+        with self._lock:
+            previous, current = self._previous, self._current
+            alpha = min(max((now - current.time) / self.step, 0), 1)
+
+            count = len(current.location)
+            store.location[:count] = previous.location + alpha * (current.location - previous.location)
+            # Turn the short way around, so angles wrapping at 360 don't spin backwards.
+            turn = (current.rotation - previous.rotation + 180) % 360 - 180
+            store.rotation[:count] = (previous.rotation + alpha * turn) % 360
+
+            # Only asteroids that were alive in both, and not respawned since, can be interpolated.
+            moved = previous.asteroid_alive & (current.asteroid_age > previous.asteroid_age)
+            location = current.asteroid_location.copy()
+            location[moved] = previous.asteroid_location[moved] + alpha * (
+                current.asteroid_location[moved] - previous.asteroid_location[moved])
+            rotation = current.asteroid_rotation.copy()
+            rotation[moved] = previous.asteroid_rotation[moved] + alpha * (
+                current.asteroid_rotation[moved] - previous.asteroid_rotation[moved])
+            world.asteroids.show(current.asteroid_alive.copy(), current.asteroid_model.copy(), location, rotation)
+            # Belts move and are culled by tick on the render thread, so it has to keep pace with the bodies.
+            world.tick = previous.tick + alpha * (current.tick - previous.tick)
+
+    def __str__(self):
+        return '%d Hz, %d steps, %d dropped' % (1 / self.step, self.steps, self.dropped)
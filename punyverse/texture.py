@@ -2,14 +2,19 @@ from __future__ import print_function
 
 import os.path
 import struct
-from ctypes import c_int, byref
+from ctypes import c_int, byref, create_string_buffer, memmove, sizeof
 from io import BytesIO
 
+import numpy
 import six
 from pyglet import image
 from pyglet.gl import *
 from six.moves import range
 
+from punyverse.cache import CacheStats, cache_path, file_stamp, read_cache, stamps_valid, write_cache
+from punyverse.glstate import state
+from punyverse.utils import Prefetcher, prefetcher
+
 try:
     from ._glgeom import bgr_to_rgb, flip_vertical
 except ImportError:
@@ -43,10 +48,42 @@ except ImportError:
         return six.binary_type(result)
 
 __all__ = ['load_texture', 'load_alpha_mask', 'load_image', 'get_best_texture', 'max_texture_size',
-           'get_cube_map', 'load_texture_1d']
+           'get_cube_map', 'load_texture_1d', 'prefetch_image']
 
 id = 0
 cache = {}
+cache_stats = CacheStats()
+_max_texture_size = None
+
+# Set to True to have the driver compress textures before they are cached, i.e. with --compress-textures.
+compress_textures = False
+
+# Set to True to have get_best_texture stream textures in over several frames, i.e. with --stream-textures.
+streaming = False
+stream_budget = 4 << 20  # Bytes uploaded per frame by the texture streamer
+placeholder_size = 64  # Mip levels this small are uploaded immediately when streaming
+
+cube_map_faces = [
+    GL_TEXTURE_CUBE_MAP_POSITIVE_X,
+    GL_TEXTURE_CUBE_MAP_NEGATIVE_X,
+    GL_TEXTURE_CUBE_MAP_POSITIVE_Y,
+    GL_TEXTURE_CUBE_MAP_NEGATIVE_Y,
+    GL_TEXTURE_CUBE_MAP_POSITIVE_Z,
+    GL_TEXTURE_CUBE_MAP_NEGATIVE_Z,
+]
+
+# Internal format: (format, channels) used to read back and re-upload the uncompressed texture.
+texture_formats = {
+    GL_RGB8: (GL_RGB, 3),
+    GL_RGBA8: (GL_RGBA, 4),
+    GL_R8: (GL_RED, 1),
+}
+
+compressed_formats = {
+    GL_RGB8: GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+    GL_RGBA8: GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+    GL_R8: GL_COMPRESSED_RED_RGTC1,
+}
 
 
 def is_power2(num):
@@ -118,44 +155,47 @@ def glGetInteger(index):
 
 
 def max_texture_size():
-    size = glGetInteger(GL_MAX_TEXTURE_SIZE)
-    if gl_info.get_vendor() == 'Intel':
-        # Intel can't seem to handle more than 4096
-        size = min(size, 4096)
-    return size
-
-
-def check_size(width, height):
+    # Cached, since images are decoded on worker threads without an OpenGL context.
+    global _max_texture_size
+    if _max_texture_size is None:
+        size = glGetInteger(GL_MAX_TEXTURE_SIZE)
+        if gl_info.get_vendor() == 'Intel':
+            # Intel can't seem to handle more than 4096
+            size = min(size, 4096)
+        _max_texture_size = size
+    return _max_texture_size
+
+
+def check_size(file, width, height):
     max_texture = max_texture_size()
 
     if width > max_texture or height > max_texture:
-        print('too large')
+        print('Loading image %s... too large' % file)
         raise ValueError('Texture too large')
 
 
-def load_image(file, path):
-    print('Loading image %s...' % file, end=' ')
-
+def decode_image(file, path):
     try:
-        file = open(path, 'rb')
+        file_obj = open(path, 'rb')
     except IOError:
-        print('does not exist')
+        print('Loading image %s... does not exist' % file)
         raise ValueError('Texture does not exist')
 
-    type, width, height = image_info(file.read(65536))
-    file.seek(0, 0)
-    if type:
-        check_size(width, height)
+    with file_obj:
+        type, width, height = image_info(file_obj.read(65536))
+        file_obj.seek(0, 0)
+        if type:
+            check_size(file, width, height)
 
-    try:
-        raw = image.load(path, file=file)
-    except Exception:
-        print('cannot be loaded')
-        raise ValueError('cannot be loaded')
+        try:
+            raw = image.load(path, file=file_obj)
+        except Exception:
+            print('Loading image %s... cannot be loaded' % file)
+            raise ValueError('cannot be loaded')
 
     width, height = raw.width, raw.height
-    check_size(width, height)
-    print()
+    check_size(file, width, height)
+    print('Loading image %s...' % file)
 
     mode = GL_RGBA if 'A' in raw.format else GL_RGB
 
@@ -174,6 +214,10 @@ def load_image(file, path):
     return path, width, height, len(raw.format), mode, flip_vertical(texture, width, height)
 
 
+def load_image(file, path):
+    return prefetcher.take(path, decode_image, file, path)
+
+
 def get_file_path(file):
     if os.path.isabs(file):
         path = file
@@ -204,76 +248,229 @@ def get_internal_mode(mode):
     }[mode]
 
 
-def load_texture(file, clamp=False):
-    path, file = get_file_path(file)
-    if path in cache:
-        return cache[path]
+def get_level_parameter(target, level, name):
+    buf = c_int()
+    glGetTexLevelParameteriv(target, level, name, byref(buf))
+    return buf.value
 
-    path, width, height, depth, mode, texture = load_image(file, path)
 
-    id = create_texture()
-    glBindTexture(GL_TEXTURE_2D, id)
-    glTexImage2D(GL_TEXTURE_2D, 0, get_internal_mode(mode), width, height, 0, mode, GL_UNSIGNED_BYTE, texture)
-    glGenerateMipmap(GL_TEXTURE_2D)
+def texture_average(id):
+    """Returns the average colour of a 2D texture, from the coarsest of its mip levels that is loaded."""
+    state.bind_texture(GL_TEXTURE_2D, id)
+    level = c_int()
+    glGetTexParameteriv(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, byref(level))
+    level = level.value
+    width = get_level_parameter(GL_TEXTURE_2D, level, GL_TEXTURE_WIDTH)
+    height = get_level_parameter(GL_TEXTURE_2D, level, GL_TEXTURE_HEIGHT)
+    while width * height > 1 and get_level_parameter(GL_TEXTURE_2D, level + 1, GL_TEXTURE_WIDTH):
+        level += 1
+        width = get_level_parameter(GL_TEXTURE_2D, level, GL_TEXTURE_WIDTH)
+        height = get_level_parameter(GL_TEXTURE_2D, level, GL_TEXTURE_HEIGHT)
 
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    buffer = (GLfloat * (width * height * 3))()
+    glGetTexImage(GL_TEXTURE_2D, level, GL_RGB, GL_FLOAT, buffer)
+    return tuple(numpy.frombuffer(buffer, numpy.float32).reshape(-1, 3).mean(axis=0))
 
-    if clamp:
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
 
-    if gl_info.have_extension('GL_EXT_texture_filter_anisotropic'):
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, glGetInteger(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT))
+def read_texture_cache(kind, paths):
+    def validate(header):
+        return header['paths'] == paths and stamps_valid(header['depends'])
 
-    cache[path] = id
+    return read_cache(cache_path('textures', kind, paths, compress_textures), validate)
+
+
+def upload_cached_texture(target, header, views):
+    """Uploads a cached mip chain into the currently bound texture."""
+    internal, format = header['internal'], header['format']
+    max_level = 0
+
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    for (face, level, width, height), data in zip(header['levels'], views):
+        if header['compressed']:
+            glCompressedTexImage2D(face, level, internal, width, height, 0, sizeof(data), data)
+        elif target == GL_TEXTURE_1D:
+            glTexImage1D(face, level, internal, width, 0, format, GL_UNSIGNED_BYTE, data)
+        else:
+            glTexImage2D(face, level, internal, width, height, 0, format, GL_UNSIGNED_BYTE, data)
+        max_level = max(max_level, level)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+    glTexParameteri(target, GL_TEXTURE_MAX_LEVEL, max_level)
+
+
+def read_texture_levels(faces, format, channels, compressed):
+    """Reads back every mip level of every face of the currently bound texture."""
+    levels = []
+    buffers = []
+
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    for face in faces:
+        for level in range(32):
+            width = get_level_parameter(face, level, GL_TEXTURE_WIDTH)
+            height = get_level_parameter(face, level, GL_TEXTURE_HEIGHT)
+            if not width:
+                break
+
+            if compressed:
+                buffer = create_string_buffer(get_level_parameter(face, level, GL_TEXTURE_COMPRESSED_IMAGE_SIZE))
+                glGetCompressedTexImage(face, level, buffer)
+            else:
+                buffer = create_string_buffer(width * height * channels)
+                glGetTexImage(face, level, format, GL_UNSIGNED_BYTE, buffer)
+            levels.append((face, level, width, height))
+            buffers.append(buffer)
+    glPixelStorei(GL_PACK_ALIGNMENT, 4)
+    return levels, buffers
+
+
+def store_texture(id, target, kind, paths, internal):
+    """Writes the mip chain of a freshly loaded texture to the cache.
+
+    When texture compression is enabled and supported, the texture is replaced by a compressed copy,
+    which is what gets cached. Returns the id of the texture to use."""
+    format, channels = texture_formats[internal]
+    faces = cube_map_faces if target == GL_TEXTURE_CUBE_MAP else [target]
+
+    glBindTexture(target, id)
+    levels, buffers = read_texture_levels(faces, format, channels, False)
+
+    compressed = compressed_formats.get(internal) if compress_textures and target != GL_TEXTURE_1D else None
+    if compressed and (compressed == GL_COMPRESSED_RED_RGTC1 or
+                       gl_info.have_extension('GL_EXT_texture_compression_s3tc')):
+        # Let the driver compress every level, then read back what it made of it.
+        compressed_id = create_texture()
+        glBindTexture(target, compressed_id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for (face, level, width, height), data in zip(levels, buffers):
+            glTexImage2D(face, level, compressed, width, height, 0, format, GL_UNSIGNED_BYTE, data)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glTexParameteri(target, GL_TEXTURE_MAX_LEVEL, max(level for face, level, width, height in levels))
+
+        if get_level_parameter(faces[0], 0, GL_TEXTURE_COMPRESSED):
+            delete_texture(id)
+            id, internal = compressed_id, compressed
+            levels, buffers = read_texture_levels(faces, format, channels, True)
+        else:
+            delete_texture(compressed_id)
+            glBindTexture(target, id)
+
+    header = {
+        'paths': paths,
+        'depends': [(path, file_stamp(path)) for path in paths],
+        'internal': internal,
+        'format': format,
+        'compressed': internal not in texture_formats,
+        'levels': levels,
+    }
+    write_cache(cache_path('textures', kind, paths, compress_textures), header, buffers)
     return id
 
 
-def load_texture_1d(file, clamp=False):
+def prefetch_image(file, kind='2d'):
+    """Starts decoding an image on a worker thread, to be picked up by load_image.
+
+    Nothing is decoded if the texture it is going to be loaded as is already cached."""
     path, file = get_file_path(file)
-    path, width, height, depth, mode, texture = load_image(file, path)
+    if path not in cache and read_texture_cache(kind, [path]) is None:
+        max_texture_size()
+        prefetcher.submit(path, decode_image, file, path)
+
+
+def prefetch_cube_map(files):
+    paths = [get_file_path(file)[0] for file in files]
+    if read_texture_cache('cube', paths) is None:
+        for file in files:
+            prefetch_image(file)
 
-    id = create_texture()
-    glBindTexture(GL_TEXTURE_1D, id)
 
-    glTexImage1D(GL_TEXTURE_1D, 0, get_internal_mode(mode), width, 0, mode, GL_UNSIGNED_BYTE, texture)
-    glGenerateMipmap(GL_TEXTURE_1D)
+def set_texture_parameters(target, clamp):
+    if target != GL_TEXTURE_1D:
+        glTexParameteri(target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
 
     if clamp:
-        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(target, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        if target != GL_TEXTURE_1D:
+            glTexParameteri(target, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
 
     if gl_info.have_extension('GL_EXT_texture_filter_anisotropic'):
-        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAX_ANISOTROPY_EXT, glGetInteger(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT))
+        glTexParameteri(target, GL_TEXTURE_MAX_ANISOTROPY_EXT, glGetInteger(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT))
 
+
+def load_cached_texture(target, kind, paths):
+    cached = read_texture_cache(kind, paths)
+    if cached is None:
+        cache_stats.miss()
+        return None
+
+    header, views = cached
+    face, level, width, height = header['levels'][0]
+    check_size(os.path.basename(paths[0]), width, height)
+
+    cache_stats.hit()
+    print('Loading image %s... cached' % os.path.basename(paths[0]))
+    id = create_texture()
+    glBindTexture(target, id)
+    upload_cached_texture(target, header, views)
     return id
 
 
-def load_alpha_mask(file, clamp=False):
+def load_texture(file, clamp=False):
     path, file = get_file_path(file)
-    path, width, height, depth, mode, texture = load_image(file, path)
+    if path in cache:
+        return cache[path]
 
-    if depth != 1:
-        texture = texture[::depth]
+    id = load_cached_texture(GL_TEXTURE_2D, '2d', [path])
+    if id is None:
+        path, width, height, depth, mode, texture = load_image(file, path)
 
-    buffer = GLuint()
-    glGenTextures(1, byref(buffer))
-    id = buffer.value
+        id = create_texture()
+        glBindTexture(GL_TEXTURE_2D, id)
+        glTexImage2D(GL_TEXTURE_2D, 0, get_internal_mode(mode), width, height, 0, mode, GL_UNSIGNED_BYTE, texture)
+        glGenerateMipmap(GL_TEXTURE_2D)
+        id = store_texture(id, GL_TEXTURE_2D, '2d', [path], get_internal_mode(mode))
 
-    glBindTexture(GL_TEXTURE_2D, id)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_R8, width, height, 0, GL_RED, GL_UNSIGNED_BYTE, texture)
-    glGenerateMipmap(GL_TEXTURE_2D)
+    set_texture_parameters(GL_TEXTURE_2D, clamp)
 
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    cache[path] = id
+    return id
 
-    if clamp:
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
 
-    if gl_info.have_extension('GL_EXT_texture_filter_anisotropic'):
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, glGetInteger(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT))
+def load_texture_1d(file, clamp=False):
+    path, file = get_file_path(file)
+
+    id = load_cached_texture(GL_TEXTURE_1D, '1d', [path])
+    if id is None:
+        path, width, height, depth, mode, texture = load_image(file, path)
+
+        id = create_texture()
+        glBindTexture(GL_TEXTURE_1D, id)
+
+        glTexImage1D(GL_TEXTURE_1D, 0, get_internal_mode(mode), width, 0, mode, GL_UNSIGNED_BYTE, texture)
+        glGenerateMipmap(GL_TEXTURE_1D)
+        id = store_texture(id, GL_TEXTURE_1D, '1d', [path], get_internal_mode(mode))
+
+    set_texture_parameters(GL_TEXTURE_1D, clamp)
+    return id
+
+
+def load_alpha_mask(file, clamp=False):
+    path, file = get_file_path(file)
+
+    id = load_cached_texture(GL_TEXTURE_2D, 'alpha', [path])
+    if id is None:
+        path, width, height, depth, mode, texture = load_image(file, path)
 
+        if depth != 1:
+            texture = texture[::depth]
+
+        id = create_texture()
+        glBindTexture(GL_TEXTURE_2D, id)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_R8, width, height, 0, GL_RED, GL_UNSIGNED_BYTE, texture)
+        glGenerateMipmap(GL_TEXTURE_2D)
+        id = store_texture(id, GL_TEXTURE_2D, 'alpha', [path], GL_R8)
+
+    set_texture_parameters(GL_TEXTURE_2D, clamp)
     return id
 
 
@@ -281,19 +478,20 @@ def get_cube_map(files, callback=None):
     assert len(files) == 6
     callback = callback or (lambda index, file: None)
 
+    paths = [get_file_path(file)[0] for file in files]
+    id = load_cached_texture(GL_TEXTURE_CUBE_MAP, 'cube', paths)
+    if id is not None:
+        for index, path in enumerate(paths):
+            callback(index, os.path.basename(path))
+        return id
+
     id = create_texture()
 
     glBindTexture(GL_TEXTURE_CUBE_MAP, id)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_BASE_LEVEL, 0)
     glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAX_LEVEL, 0)
-    for index, (file, part) in enumerate(zip(files, [
-        GL_TEXTURE_CUBE_MAP_POSITIVE_X,
-        GL_TEXTURE_CUBE_MAP_NEGATIVE_X,
-        GL_TEXTURE_CUBE_MAP_POSITIVE_Y,
-        GL_TEXTURE_CUBE_MAP_NEGATIVE_Y,
-        GL_TEXTURE_CUBE_MAP_POSITIVE_Z,
-        GL_TEXTURE_CUBE_MAP_NEGATIVE_Z,
-    ])):
+    internal = None
+    for index, (file, part) in enumerate(zip(files, cube_map_faces)):
         try:
             path, file = get_file_path(file)
             callback(index, file)
@@ -301,12 +499,273 @@ def get_cube_map(files, callback=None):
         except Exception:
             delete_texture(id)
             raise
-        glTexImage2D(part, 0, get_internal_mode(mode), width, height, 0, mode, GL_UNSIGNED_BYTE, texture)
+        internal = get_internal_mode(mode)
+        glTexImage2D(part, 0, internal, width, height, 0, mode, GL_UNSIGNED_BYTE, texture)
+
+    return store_texture(id, GL_TEXTURE_CUBE_MAP, 'cube', paths, internal)
+
+
+def mip_chain(data, width, height, depth):
+    """Box filters a decoded image down to 1x1, the way glGenerateMipmap would."""
+    level = numpy.frombuffer(data, numpy.uint8).reshape(height, width, depth)
+    levels = [level]
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        height, width = level.shape[:2]
+        sum = level.astype(numpy.uint16)
+        count = 1
+        if height > 1:
+            sum = sum[0:height // 2 * 2:2] + sum[1:height // 2 * 2:2]
+            count *= 2
+        if width > 1:
+            sum = sum[:, 0:width // 2 * 2:2] + sum[:, 1:width // 2 * 2:2]
+            count *= 2
+        level = ((sum + count // 2) // count).astype(numpy.uint8)
+        levels.append(level)
+    return levels
+
+
+def decode_mip_chain(files):
+    for path, file in files:
+        try:
+            path, width, height, depth, mode, texture = decode_image(file, path)
+        except ValueError:
+            continue
+        return path, mode, mip_chain(texture, width, height, depth)
+    raise ValueError('No texture found')
+
+
+class StreamingTexture(object):
+    def __init__(self, id, files):
+        self.id = id
+        self.files = files
+        self.path = None
+        self.internal = None
+        self.format = None
+        self.compressed = False
+        self.chain = None  # [(level, width, height, data)]
+        self.levels = None  # Levels yet to be uploaded, coarsest first
+        self.row = 0
+        self.store = False
+
+    def set_levels(self, path, internal, format, compressed, levels):
+        self.path = path
+        self.internal = internal
+        self.format = format
+        self.compressed = compressed
+        self.chain = levels
+        self.levels = sorted(levels, reverse=True)
+
+        # Upload the tiny levels right away, so the texture is complete at all times.
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        base = None
+        while self.levels and max(self.levels[0][1:3]) <= placeholder_size:
+            level, width, height, data = self.levels.pop(0)
+            if compressed:
+                glCompressedTexImage2D(GL_TEXTURE_2D, level, internal, width, height, 0, data.nbytes, data.ctypes.data)
+            else:
+                glTexImage2D(GL_TEXTURE_2D, level, internal, width, height, 0, format, GL_UNSIGNED_BYTE,
+                             data.ctypes.data)
+            base = level if base is None else min(base, level)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+        if base is not None:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, base)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, max(level for level, w, h, d in levels))
+
+    def upload(self, pbo, budget):
+        """Uploads at most budget bytes of the next level through the pixel buffer object.
+
+        Returns the number of bytes uploaded."""
+        level, width, height, data = self.levels[0]
+        if self.compressed:
+            # Compressed levels can't be specified piecewise, so they always go up whole.
+            size = data.nbytes
+            rows = height
+        else:
+            stride = width * (data.nbytes // (width * height))
+            rows = min(height - self.row, max(budget // stride, 1))
+            size = rows * stride
+
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, size, None, GL_STREAM_DRAW)
+        pointer = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, size, GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+        memmove(pointer, data.ctypes.data + (0 if self.compressed else self.row * stride), size)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if self.compressed:
+            glCompressedTexImage2D(GL_TEXTURE_2D, level, self.internal, width, height, 0, size, 0)
+        else:
+            if not self.row:
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+                glTexImage2D(GL_TEXTURE_2D, level, self.internal, width, height, 0, self.format, GL_UNSIGNED_BYTE,
+                             None)
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+            glTexSubImage2D(GL_TEXTURE_2D, level, 0, self.row, width, rows, self.format, GL_UNSIGNED_BYTE, 0)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+        self.row += rows
+        if self.row >= height:
+            # The level is complete, so it can now be sampled from.
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, level)
+            self.levels.pop(0)
+            self.row = 0
+        return size
+
+    @property
+    def done(self):
+        return self.levels is not None and not self.levels
+
+
+class TextureStreamer(object):
+    """Uploads full resolution textures over several frames, behind a placeholder.
+
+    Images are decoded on worker threads of its own, since the streamer outlives the loading phase.
+    Call update once every frame with the OpenGL context current."""
+
+    def __init__(self):
+        self._decoder = Prefetcher()
+        self._textures = []
+        self._pbo = None
+
+    def __len__(self):
+        return len(self._textures)
+
+    def add(self, texture, decode=True):
+        if decode:
+            self._decoder.submit(texture.id, decode_mip_chain, texture.files)
+        self._textures.append(texture)
+
+    def update(self):
+        if not self._textures:
+            return
+
+        budget = stream_budget
+        for texture in list(self._textures):
+            if budget <= 0:
+                break
+
+            if texture.levels is None:
+                if not self._decoder.ready(texture.id):
+                    continue
+                try:
+                    path, mode, levels = self._decoder.take(texture.id, decode_mip_chain, texture.files)
+                except ValueError:
+                    self._textures.remove(texture)
+                    continue
+                texture.store = True
+                texture.set_levels(path, get_internal_mode(mode), mode, False,
+                                   [(level, data.shape[1], data.shape[0], data)
+                                    for level, data in enumerate(levels)])
+
+            if texture.levels:
+                if self._pbo is None:
+                    buffer = GLuint()
+                    glGenBuffers(1, byref(buffer))
+                    self._pbo = buffer.value
+                budget -= texture.upload(self._pbo, budget)
+
+            if texture.done:
+                self._textures.remove(texture)
+                if texture.store:
+                    self._store(texture)
+
+    def _store(self, texture):
+        # Streamed levels are uncompressed, and shouldn't take the place of a compressed cache entry.
+        if compress_textures:
+            return
+
+        levels = [(GL_TEXTURE_2D, level, width, height) for level, width, height, data in texture.chain]
+        buffers = [data for level, width, height, data in texture.chain]
+        header = {
+            'paths': [texture.path],
+            'depends': [(texture.path, file_stamp(texture.path))],
+            'internal': texture.internal,
+            'format': texture.format,
+            'compressed': False,
+            'levels': levels,
+        }
+        write_cache(cache_path('textures', '2d', [texture.path], compress_textures), header, buffers)
+
+    def close(self):
+        self._decoder.close()
+        self._textures = []
+
+
+streamer = TextureStreamer()
+
+
+def stream_texture(files, clamp=False):
+    """Returns a texture that starts out as a placeholder, and is streamed in by the streamer."""
+    files = [get_file_path(file) for file in files]
+    if files[0][0] in cache:
+        return cache[files[0][0]]
+
+    id = create_texture()
+    texture = StreamingTexture(id, files)
+
+    for index, (path, file) in enumerate(files):
+        cached = read_texture_cache('2d', [path])
+        if cached is None:
+            texture.files = files[index:]
+            break
 
+        header, views = cached
+        face, level, width, height = header['levels'][0]
+        try:
+            check_size(file, width, height)
+        except ValueError:
+            continue
+
+        cache_stats.hit()
+        print('Loading image %s... cached, streaming' % file)
+        texture.set_levels(path, header['internal'], header['format'], header['compressed'],
+                           [(level, width, height, numpy.frombuffer(data, numpy.uint8))
+                            for (face, level, width, height), data in zip(header['levels'], views)])
+        streamer.add(texture, decode=False)
+        break
+    else:
+        delete_texture(id)
+        raise ValueError('No texture found')
+
+    if texture.levels is None:
+        cache_stats.miss()
+        glBindTexture(GL_TEXTURE_2D, id)
+        placeholder = None
+        if len(texture.files) > 1:
+            path, file = texture.files[-1]
+            try:
+                placeholder = load_image(file, path)
+            except ValueError:
+                pass
+
+        if placeholder is None:
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB8, 1, 1, 0, GL_RGB, GL_UNSIGNED_BYTE, b'\x80\x80\x80')
+        else:
+            path, width, height, depth, mode, data = placeholder
+            glTexImage2D(GL_TEXTURE_2D, 0, get_internal_mode(mode), width, height, 0, mode, GL_UNSIGNED_BYTE, data)
+            glGenerateMipmap(GL_TEXTURE_2D)
+        streamer.add(texture)
+
+    glBindTexture(GL_TEXTURE_2D, id)
+    set_texture_parameters(GL_TEXTURE_2D, clamp)
+
+    cache[files[0][0]] = id
     return id
 
 
 def get_best_texture(info, loader=load_texture, optional=False, **kwargs):
+    if streaming and loader is load_texture and isinstance(info, list):
+        try:
+            return stream_texture(info, **kwargs)
+        except ValueError:
+            if not optional:
+                raise
+            return None
+
     if isinstance(info, list):
         for item in info:
             try:
@@ -2,7 +2,6 @@
 from __future__ import division
 import os
 import time
-from math import hypot
 from operator import attrgetter
 
 import pyglet
@@ -11,6 +10,8 @@ from pyglet.gl import *
 from pyglet.window import key, mouse
 
 from punyverse.glgeom import *
+from punyverse.glstate import state
+from punyverse.texture import streamer
 
 MOUSE_SENSITIVITY = 0.3  # Mouse sensitivity, 0..1, none...hyperspeed
 
@@ -18,14 +19,6 @@ MAX_DELTA = 5
 SEED = int(time.time())
 
 
-def entity_distance(x0, y0, z0):
-    def distance(entity):
-        x1, y1, z1 = entity.location
-        return hypot(hypot(x1 - x0, y1 - y0), z1 - z0)
-
-    return distance
-
-
 class Punyverse(pyglet.window.Window):
     def __init__(self, *args, **kwargs):
         super(Punyverse, self).__init__(*args, **kwargs)
@@ -222,19 +215,19 @@ class Punyverse(pyglet.window.Window):
         self.world.update(dt, move=self.exclusive and self.moving, tick=self.running)
 
     def on_draw(self):
+        streamer.update()
+        state.begin_frame()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         c = self.world.cam
-        x, y, z = c.x, c.y, c.z
 
         world = self.world
-        get_distance = entity_distance(x, y, z)
-        if x != world.x or y != world.y or z != world.z:
-            world.tracker.sort(key=get_distance, reverse=True)
-            world.tracker.sort(key=attrgetter('background'), reverse=True)
-            world.x, world.y, world.z = x, y, z
-
+        world.cull()
+        world.upload_frame()
         for entity in world.tracker:
-            entity.draw(self)
+            if world.system_visible[entity.row]:
+                entity.draw(self)
+        world.queue.execute()
+        world.points.draw()
 
         if self.info:
             width, height = self.get_size()
@@ -254,11 +247,27 @@ class Punyverse(pyglet.window.Window):
                 info = ('%d FPS @ (x=%.2f, y=%.2f, z=%.2f) @ %s, %s/s\n' %
                         (pyglet.clock.get_fps(), c.x, c.y, c.z, self.world.cam.speed, self.get_time_per_second()))
 
-            glEnable(GL_BLEND)
+            if self.debug:
+                average, maximum, worst = self.world.orbits.iteration_stats()
+                info = ('%s\nKepler solver: %.2f average, %d max iterations (%s)\n'
+                        'Collision: %d spheres tested\nCulling: %d drawn, %d culled\n'
+                        'Render order: %s, %d shifted in %.3f ms\n'
+                        'Bodies: %d spheres, %d impostors, %d points, %d passes skipped\n'
+                        'Render queue: %s\nGL calls: %s' %
+                        (info.rstrip('\n'), average, maximum, worst, self.world.entities.tree.tests,
+                         self.world.drawn, self.world.culled, world.queue.order, world.queue.order.shifts,
+                         world.queue.order.sort_time * 1000, world.lod_counts[0], world.lod_counts[1],
+                         world.lod_counts[2], world.skipped_passes, world.queue, state))
+                if world.orbits.tolerance is not None:
+                    info += '\nEphemeris: %d of %d orbits tabled, %d samples' % world.orbits.ephemeris_stats()
+                if world.simulation:
+                    info += '\nSimulation: %s' % world.simulation
+
+            state.enable(GL_BLEND)
             shader = self.world.activate_shader('text')
             shader.uniform_mat4('u_projMatrix', projection)
 
-            glBindTexture(GL_TEXTURE_2D, self.world.font_tex)
+            state.bind_texture(GL_TEXTURE_2D, self.world.font_tex)
             shader.uniform_texture('u_alpha', 0)
             shader.uniform_vec3('u_color', 1, 1, 1)
             shader.uniform_vec2('u_start', 10, 10)
@@ -267,7 +276,7 @@ class Punyverse(pyglet.window.Window):
             with self.info_engine.vao:
                 glDrawArrays(GL_TRIANGLES, 0, self.info_engine.vertex_count)
 
-            glDisable(GL_BLEND)
+            state.disable(GL_BLEND)
 
             glLineWidth(2)
             mvp = projection * Matrix4f.from_angles((width / 2, height /2, 0))
@@ -277,3 +286,5 @@ class Punyverse(pyglet.window.Window):
             with self.circle.vao:
                 glDrawArrays(GL_LINE_LOOP, 0, self.circle.vertex_count)
             glLineWidth(1)
+
+        state.end_frame()
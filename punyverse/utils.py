@@ -1,3 +1,7 @@
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
 class cached_property(object):
     def __init__(self, func, name=None):
         self.func = func
@@ -16,3 +20,42 @@ class cached_property(object):
                 del instance.__dict__[self.name]
         else:
             instance.__dict__[self.name] = value
+
+
+class Prefetcher(object):
+    """Runs CPU-bound loading work, like decoding images and parsing models, on worker threads.
+
+    Work is submitted ahead of time under a key. Whoever needs the result later calls take with
+    the same key, which waits for the worker, or does the work itself if it was never submitted.
+    Workers must not make any OpenGL calls."""
+
+    def __init__(self):
+        self._pool = None
+        self._pending = {}
+
+    def submit(self, key, func, *args):
+        if key in self._pending:
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(cpu_count())
+        self._pending[key] = self._pool.apply_async(func, args)
+
+    def ready(self, key):
+        result = self._pending.get(key)
+        return result is None or result.ready()
+
+    def take(self, key, func, *args):
+        result = self._pending.pop(key, None)
+        if result is None:
+            return func(*args)
+        return result.get()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._pending.clear()
+
+
+prefetcher = Prefetcher()
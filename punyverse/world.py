@@ -3,13 +3,23 @@ from __future__ import division
 import json
 import os
 from collections import OrderedDict
+from math import tan
 
+import numpy
 import six
 
-from punyverse import texture
+from punyverse import model, simulation, texture
+from punyverse.model import prefetch_model
+from punyverse.texture import prefetch_cube_map, prefetch_image
 from punyverse.camera import Camera
 from punyverse.entity import *
-from punyverse.shader import Program
+from punyverse.glgeom import Matrix4f, Quad, belt_cache_stats, frustum_planes
+from punyverse.glstate import state
+from punyverse.orbit import OrbitEngine
+from punyverse.render import PointSprites, RenderQueue
+from punyverse.shader import FrameBlock, Program
+from punyverse.simulation import Simulation
+from punyverse.utils import cached_property, prefetcher
 
 
 def load_world(file, callback=lambda message, completion: None):
@@ -28,43 +38,63 @@ class World(object):
         'line': ('line.vertex.glsl', 'line.fragment.glsl'),
         'model': ('model.vertex.glsl', 'model.fragment.glsl'),
         'belt': ('belt.vertex.glsl', 'model.fragment.glsl'),
+        'asteroid': ('asteroid.vertex.glsl', 'model.fragment.glsl'),
+        'belt_points': ('belt_points.vertex.glsl', 'belt_points.fragment.glsl'),
+        'impostor': ('impostor.vertex.glsl', 'impostor.fragment.glsl'),
+        'sprite': ('sprite.vertex.glsl', 'sprite.fragment.glsl'),
     }
 
     def __init__(self, file, callback, sky=True):
+        self.entities = EntityStore()
         self.tracker = []
-        self.x = None
-        self.y = None
-        self.z = None
+        self.queue = RenderQueue()
         self.tick_length = 0
         self.tick = 0
-        self.asteroids = AsteroidManager(self)
+        self.orbits = OrbitEngine()
         self.cam = Camera()
 
         self._sky = sky
 
-        self._program = None
         self.callback = callback
         self.programs = self._load_programs()
-        self._parse(file)
+        self.asteroids = AsteroidSystem(self)
+        self.impostor = Quad(self.activate_shader('impostor'))
+        self.points = PointSprites(self)
+        try:
+            self._parse(file)
+        finally:
+            prefetcher.close()
 
         del self.callback  # So it can't be used after loading finishes
 
+        # Bodies that orbit lines are drawn around.
+        self.orbit_parents = [entity for entity in self.entities.entities
+                              if isinstance(entity, Body) and any(body.orbit for body in entity.satellites)]
+
         self._time_accumulate = 0
         self._projection_matrix = self.cam.projection_matrix()
-
-        for entity in self.tracker:
-            entity.update()
-
-        for name in ('planet', 'model', 'belt'):
-            shader = self.activate_shader(name)
-            shader.uniform_vec3('u_sun.ambient', 0.1, 0.1, 0.1)
-            shader.uniform_vec3('u_sun.diffuse', 1, 1, 1)
-            shader.uniform_vec3('u_sun.specular', 0.5, 0.5, 0.5)
-            shader.uniform_vec3('u_sun.position', 0, 0, 0)
-            shader.uniform_float('u_sun.intensity', 1)
-
-        shader = self.activate_shader('clouds')
-        shader.uniform_vec3('u_sun', 0, 0, 0)
+        self._last_position = self.cam.x, self.cam.y, self.cam.z
+
+        # Filled in by cull every frame.
+        self.visible = self.system_visible = self.orbit_visible = numpy.ones(0, dtype=bool)
+        self.frustum = frustum_planes(self.vp_matrix)
+        self.pixel_scale = 1  # Pixels per world unit at unit distance, set on resize
+        self.drawn = self.culled = 0
+        self.lod_counts = [0, 0, 0]  # Spherical bodies drawn as spheres, impostors and points
+        self.skipped_passes = 0  # Atmosphere, cloud and ring passes left out for being too small to see
+
+        self.orbits.update(self.tick)
+        self.entities.update(self.tick, self.orbits)
+        self._update_matrices()
+
+        self.simulation = None
+        if simulation.rate:
+            self.simulation = Simulation(self, simulation.rate)
+            self.simulation.start()
+
+        self.frame = FrameBlock()
+        self.frame.sun(ambient=(0.1, 0.1, 0.1), diffuse=(1, 1, 1), specular=(0.5, 0.5, 0.5), position=(0, 0, 0),
+                       intensity=1)
         self.activate_shader(None)
 
     def _load_programs(self):
@@ -96,6 +126,7 @@ class World(object):
         self._context = {'AU': self._au, 'TEXTURE': texture.max_texture_size(), 'KM': 1.0 / self._length}
 
         self.tick_length = root.get('tick', 4320)  # How many second is a tick?
+        self.orbits.tolerance = root.get('ephemeris')
 
         # Need to know how many objects are being loaded
         self._objects = 0
@@ -107,6 +138,8 @@ class World(object):
                 count_objects(body.get('satellites', {}))
         count_objects(root['bodies'])
 
+        self._prefetch(root)
+
         if 'start' in root:
             info = root['start']
             self.cam.x = self.evaluate(info.get('x', 0))
@@ -139,9 +172,61 @@ class World(object):
             for i, file in enumerate(asteroids):
                 self.callback('Loading asteroids...', 'Loading %s...' % file, i / len(asteroids))
                 self.asteroids.load(file)
+            self.asteroids.build()
+            self.tracker.append(self.asteroids)
 
         self.font_tex = load_alpha_mask(root['font'], clamp=True)
 
+        self.callback('Loading models...', 'Model cache: %s, texture cache: %s, belt cache: %s.' %
+                      (model.cache_stats, texture.cache_stats, belt_cache_stats), 1)
+
+    def _prefetch(self, root):
+        # Decode textures and parse models on worker threads, in the order they are needed.
+        # Only the first choice of each texture list is prefetched, fallbacks are loaded on demand.
+        def first(files):
+            return files[0] if isinstance(files, list) else files
+
+        def models(info, scale=1):
+            scale = info.get('scale', scale)
+            files = info['model'] if isinstance(info['model'], list) else [info['model']]
+            for file in files:
+                prefetch_model(file, info.get('sx', scale), info.get('sy', scale), info.get('sz', scale))
+
+        def body(info):
+            if 'texture' in info:
+                # Streamed textures are decoded by the streamer after loading.
+                if not texture.streaming:
+                    for key in ('texture', 'normal_map', 'specular_map', 'emission_map'):
+                        if key in info:
+                            prefetch_image(first(info[key]))
+                atmosphere = info.get('atmosphere', {})
+                if 'cloud_texture' in atmosphere:
+                    prefetch_image(first(atmosphere['cloud_texture']), 'alpha')
+                if 'glow_texture' in atmosphere:
+                    prefetch_image(first(atmosphere['glow_texture']), '1d')
+                if 'ring' in info:
+                    prefetch_image(info['ring']['texture'], '1d')
+            elif 'model' in info:
+                models(info)
+
+            for satellite in six.itervalues(info.get('satellites', {})):
+                body(satellite)
+
+        for info in six.itervalues(root['bodies']):
+            body(info)
+
+        for info in six.itervalues(root.get('belts', {})):
+            models(info)
+
+        if 'sky' in root and self._sky:
+            prefetch_cube_map(first(root['sky']['texture']))
+            prefetch_cube_map(root['sky']['constellation'])
+
+        for file in root.get('asteroids', []):
+            prefetch_model(file, 5, 5, 5)
+
+        prefetch_image(root['font'], 'alpha')
+
     def _body(self, name, info, parent=None):
         if 'texture' in info:
             body = SphericalBody(name, self, info, parent)
@@ -152,8 +237,6 @@ class World(object):
 
         if parent:
             parent.satellites.append(body)
-        else:
-            self.tracker.append(body)
 
         for satellite, info in six.iteritems(info.get('satellites', {})):
             self.callback('Loading objects (%d of %d)...' % (self._current_object, self._objects),
@@ -161,34 +244,103 @@ class World(object):
             self._body(satellite, info, body)
             self._current_object += 1
 
+        if not parent:
+            self.tracker.append(body)
+
     def spawn_asteroid(self):
         if self.asteroids:
             c = self.cam
             dx, dy, dz = c.direction()
             speed = abs(self.cam.speed) * 1.1 + 5
-            self.tracker.append(self.asteroids.new((c.x, c.y - 3, c.z + 5), (dx * speed, dy * speed, dz * speed)))
+            spawn = self.simulation.spawn_asteroid if self.simulation else self.asteroids.spawn
+            spawn((c.x, c.y - 3, c.z + 5), (dx * speed, dy * speed, dz * speed))
 
     def update(self, dt, move, tick):
         c = self.cam
         c.update(dt, move)
         self.vp_matrix = None
 
-        if tick:
+        if self.simulation:
+            self.simulation.running = tick
+            self.simulation.interpolate()
+            self.entities.refit()
+        elif tick:
             delta = self.tick_length * dt
             update = int(delta + self._time_accumulate + 0.5)
             if update:
                 self._time_accumulate = 0
                 self.tick += update
-
-                for entity in self.tracker:
-                    entity.update()
-                    collision = entity.collides(c.x, c.y, c.z)
-                    if collision:
-                        c.speed *= -1
-                        c.move(c.speed * 12 * dt)
+                self.orbits.update(self.tick)
+                self.entities.update(self.tick, self.orbits)
+                self.asteroids.update((c.x, c.y, c.z))
             else:
                 self._time_accumulate += delta
 
+        # Every frame, paused or not, as the camera moves whether or not the world does.
+        self._collide(dt)
+        self._update_matrices()
+
+    def _collide(self, dt):
+        # Swept along the camera's path over the last frame, so it can't tunnel through bodies.
+        c = self.cam
+        if self.entities.collides(self._last_position, (c.x, c.y, c.z)):
+            c.speed *= -1
+            c.move(c.speed * 12 * dt)
+        self._last_position = c.x, c.y, c.z
+
+    def _update_matrices(self):
+        # Only the model matrices: shaders compose them with the view and projection from the Frame block.
+        entities = self.entities.entities
+        count = len(entities)
+        for entity, location, rotation in zip(entities, self.entities.location[:count].tolist(),
+                                              self.entities.rotation[:count].tolist()):
+            Matrix4f.from_angles(location, rotation, out=entity.model_matrix)
+
+    def upload_frame(self):
+        """Sends the camera matrices for this frame to every program at once, before drawing.
+
+        Orbit lines are drawn with the line shader, which doesn't use them, so their matrices are multiplied out
+        here too, in one batch."""
+        c = self.cam
+        self.frame.upload(self.view_matrix(), self.projection_matrix(), self.vp_matrix, (c.x, c.y, c.z))
+
+        parents = self.orbit_parents
+        for parent, mvp in zip(parents, Matrix4f.batch_multiply(self.vp_matrix,
+                                                                [parent.orbit_matrix for parent in parents])):
+            parent.orbit_mvp = mvp
+
+    def cull(self):
+        """Tests every entity against the view frustum, before drawing a frame.
+
+        system_visible is whether anything in an entity's satellite system may be visible, visible is whether the
+        entity itself may be, and orbit_visible is whether the orbit line it traces around its parent may be."""
+        store = self.entities
+        count = len(store)
+        self.frustum = planes = frustum_planes(self.vp_matrix)
+
+        self.system_visible = system = store.draw_tree.visible(planes)
+
+        def inside(centres, radius):
+            return (centres.dot(planes[:, :3].T) + planes[:, 3] >= -radius[:, None]).all(axis=1)
+
+        parent = store.parent[:count]
+        self.visible = system & inside(store.location[:count], store.extent[:count])
+        self.orbit_visible = orbit = numpy.zeros(count, dtype=bool)
+        rows = numpy.flatnonzero((parent >= 0) & system[numpy.maximum(parent, 0)])
+        orbit[rows] = inside(store.location[parent[rows]], store.orbit_extent[rows])
+
+        self.drawn = int(self.visible.sum())
+        self.culled = count - self.drawn
+        self.lod_counts = [0, 0, 0]
+        self.skipped_passes = 0
+
+    def pixel_radius(self, location, radius):
+        """Returns the radius on screen, in pixels, of a sphere at location, from its w under vp_matrix."""
+        m = self.vp_matrix.matrix
+        x, y, z = location
+        w = m[3] * x + m[7] * y + m[11] * z + m[15]
+        return radius * self.pixel_scale / max(w, self.cam.znear)
+
     def view_matrix(self):
         return self.cam.view_matrix
 
@@ -201,18 +353,11 @@ class World(object):
 
     def resize(self, width, height):
         self.cam.aspect = width / max(height, 1)
+        self.pixel_scale = height / (2 * tan(self.cam.fov / 2))
         self._projection_matrix = self.cam.projection_matrix()
         self.vp_matrix = None
 
     def activate_shader(self, name):
-        program = None
-        if self._program != name:
-            if name is None:
-                glUseProgram(0)
-            else:
-                program = self.programs[name]
-                glUseProgram(program.program)
-            self._program = name
-        elif self._program is not None:
-            program = self.programs[self._program]
+        program = None if name is None else self.programs[name]
+        state.use_program(0 if program is None else program.program)
         return program